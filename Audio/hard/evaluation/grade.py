@@ -1,4 +1,8 @@
+import itertools
+
+import numpy as np
 import pandas as pd
+from scipy import sparse
 
 def load_and_check_format(test_labels_path, submission_path):
     test_df = pd.read_csv(test_labels_path)
@@ -21,32 +25,79 @@ def load_and_check_format(test_labels_path, submission_path):
     
     return test_df, sub_df, True
 
+def encode_birds(test_birds, sub_birds):
+    """
+    将两列空格分隔的 ebird 代码按共享词表编码为 CSR 0/1 指示矩阵，"nocall" 视为空行。
+    返回 (真实矩阵, 预测矩阵, 词表)。
+    """
+    # 不同的 birds 字符串远少于行数：先 factorize 整行，只拆分每个不同的字符串一次
+    factorized = [pd.factorize(birds.fillna("nocall").astype(str)) for birds in (test_birds, sub_birds)]
+    split_uniques = [[set(u.split()) - {"nocall"} for u in uniques] for _, uniques in factorized]
+    vocabulary = pd.Index(sorted(set().union(*itertools.chain.from_iterable(split_uniques))))
+
+    matrices = []
+    for (row_codes, _), token_sets in zip(factorized, split_uniques):
+        lengths = np.fromiter(map(len, token_sets), dtype=np.int64, count=len(token_sets))
+        columns = vocabulary.get_indexer(list(itertools.chain.from_iterable(token_sets)))
+        unique_matrix = sparse.csr_matrix(
+            (np.ones(len(columns), dtype=np.int32), columns, np.concatenate([[0], np.cumsum(lengths)])),
+            shape=(len(token_sets), len(vocabulary)),
+        )
+        matrices.append(unique_matrix[row_codes])
+    return matrices[0], matrices[1], vocabulary
+
+def calc_row_f1(true_matrix, pred_matrix):
+    """逐行 F1；真实与预测均为空的行记为 1。"""
+    tp = np.asarray(true_matrix.multiply(pred_matrix).sum(axis=1)).ravel().astype(float)
+    n_true = np.asarray(true_matrix.sum(axis=1)).ravel()
+    n_pred = np.asarray(pred_matrix.sum(axis=1)).ravel()
+
+    # 与逐行实现相同的查准率、召回率与 F1 公式
+    precision = np.divide(tp, n_pred, out=np.zeros_like(tp), where=n_pred > 0)
+    recall = np.divide(tp, n_true, out=np.zeros_like(tp), where=n_true > 0)
+    pr_sum = precision + recall
+    f1 = np.divide(2 * precision * recall, pr_sum, out=np.zeros_like(tp), where=pr_sum > 0)
+    f1[(n_true == 0) & (n_pred == 0)] = 1.0
+    return f1
+
 def calc_micro_f1(test_df, sub_df):
-    f1_scores = []
-    
-    for idx, (true_birds, pred_birds) in enumerate(zip(test_df['birds'], sub_df['birds'])):
-        # 分割成集合
-        true_set = set(true_birds.split()) if true_birds != "nocall" else set()
-        pred_set = set(pred_birds.split()) if pred_birds != "nocall" else set()
-        
-        # 如果都为空集合，视为完全匹配，f1=1
-        if not true_set and not pred_set:
-            f1_scores.append(1.0)
-            continue
-        
-        # 计算查准率、召回率
-        tp = len(true_set & pred_set)
-        fp = len(pred_set - true_set)
-        fn = len(true_set - pred_set)
-        
-        precision = tp / (tp + fp) if (tp + fp) > 0 else 0.0
-        recall = tp / (tp + fn) if (tp + fn) > 0 else 0.0
-        
-        f1 = (2 * precision * recall) / (precision + recall) if (precision + recall) > 0 else 0.0
-        f1_scores.append(f1)
-    
-    micro_f1 = sum(f1_scores) / len(f1_scores)
-    return micro_f1
+    true_matrix, pred_matrix, _ = encode_birds(test_df['birds'], sub_df['birds'])
+    f1_scores = calc_row_f1(true_matrix, pred_matrix)
+    micro_f1 = f1_scores.mean() if len(f1_scores) else 0.0
+    return float(micro_f1)
+
+def parse_row_ids(row_ids):
+    """
+    将 row_id（site_1_<audio_id>_<seconds>，site 3 无秒数）解析为 site、audio_id 两个分类列
+    和 seconds 数值列；无法解析的行 site/audio_id 为缺失值。
+    """
+    parts = row_ids.astype(str).str.extract(r"^(site_\d+)_([^_]+)(?:_([^_]*))?$")
+    return pd.DataFrame({
+        'site': parts[0].astype('category'),
+        'audio_id': parts[1].astype('category'),
+        'seconds': pd.to_numeric(parts[2], errors='coerce'),
+    })
+
+def _grouped_f1(f1_scores, keys):
+    # 分类列上的分组均值；无法解析 row_id 的行只计入全局分数
+    grouped = pd.Series(f1_scores, index=keys.index).groupby(
+        [keys[c] for c in keys.columns], observed=True
+    )
+    return grouped.agg(rows='size', f1='mean').reset_index()
+
+def calc_f1_breakdown(test_df, sub_df):
+    """
+    一次计算全局 micro F1 以及按 site、按音频文件的 F1。
+    返回 {'micro_f1': float, 'by_site': DataFrame, 'by_audio': DataFrame}。
+    """
+    true_matrix, pred_matrix, _ = encode_birds(test_df['birds'], sub_df['birds'])
+    f1_scores = calc_row_f1(true_matrix, pred_matrix)
+    keys = parse_row_ids(test_df['row_id'])
+    return {
+        'micro_f1': float(f1_scores.mean()) if len(f1_scores) else 0.0,
+        'by_site': _grouped_f1(f1_scores, keys[['site']]),
+        'by_audio': _grouped_f1(f1_scores, keys[['site', 'audio_id']]),
+    }
 
 def evaluate(test_labels_path, submission_path):
     test_df, sub_df, valid = load_and_check_format(test_labels_path, submission_path)
@@ -54,8 +105,11 @@ def evaluate(test_labels_path, submission_path):
         print("提交文件格式校验未通过，无法计算分数。")
         return
     
-    score = calc_micro_f1(test_df, sub_df)
-    print(f"提交文件格式正确，micro F1 score: {score:.6f}")
+    result = calc_f1_breakdown(test_df, sub_df)
+    print(f"提交文件格式正确，micro F1 score: {result['micro_f1']:.6f}")
+    for row in result['by_site'].itertuples(index=False):
+        print(f"  {row.site}: F1 {row.f1:.6f}（{row.rows} 行）")
+    return result
 
 if __name__ == "__main__":
     # 修改成你本地路径
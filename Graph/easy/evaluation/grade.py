@@ -1,12 +1,13 @@
 from os.path import join
+import itertools
 import json
-from sklearn.metrics import roc_auc_score
+import numpy as np
 import argparse
+from typing import NamedTuple, Optional
 
 import logging
 
 logger = logging.getLogger(__name__)
-logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')  # include timestamp
 
 '''
 系统评测脚本执行命令：
@@ -26,98 +27,338 @@ def load_json(rfdir, rfname):
         return data
 
 
-def format_check(submit_fname, gt_fname):
+class _JsonObjectStream:
+    """按块读取顶层 JSON 对象，逐个产出 (key, value)，整个文件不会同时驻留内存。"""
+
+    def __init__(self, rf, chunk_size):
+        self.rf = rf
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        chunk = self.rf.read(self.chunk_size)
+        self.eof = not chunk
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+
+    def _skip_ws(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buf) or self.eof:
+                return
+            self._fill()
+
+    def _expect(self, chars):
+        self._skip_ws()
+        if self.pos >= len(self.buf) or self.buf[self.pos] not in chars:
+            raise json.JSONDecodeError(f"Expecting one of {chars!r}", self.buf, self.pos)
+        self.pos += 1
+        return self.buf[self.pos - 1]
+
+    def _decode(self):
+        self._skip_ws()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                self._fill()
+                continue
+            if end == len(self.buf) and not self.eof:
+                # 数字可能被块边界截断，读入更多后重新解析
+                self._fill()
+                continue
+            self.pos = end
+            return value
+
+    def __iter__(self):
+        self._skip_ws()
+        if not self.buf.startswith('{', self.pos):
+            # 能完整解析但不是对象时与非流式读取一样报 TypeError，否则照常报解析错误
+            self._decode()
+            raise TypeError("top-level JSON value is not an object")
+        self.pos += 1
+        self._skip_ws()
+        if self.buf.startswith('}', self.pos):
+            self.pos += 1
+            return
+        while True:
+            key = self._decode()
+            if not isinstance(key, str):
+                raise json.JSONDecodeError("Expecting property name", self.buf, self.pos)
+            self._expect(':')
+            yield key, self._decode()
+            if self._expect(',}') == '}':
+                break
+        self._skip_ws()
+        if self.pos < len(self.buf):
+            raise json.JSONDecodeError("Extra data", self.buf, self.pos)
+
+
+def iter_json_items(rfdir, rfname, chunk_size=1 << 20):
+    with open(join(rfdir, rfname), 'r', encoding='utf-8') as rf:
+        yield from _JsonObjectStream(rf, chunk_size)
+
+
+def _iter_items(fname, stream=False):
+    """
+    逐个产出 JSON 顶层的 (键, 值)；文件在第一次迭代时才打开，读取错误也在迭代中抛出。
+    顶层不是对象时抛出 TypeError。
+    """
     data_dir = "./"
-    flag = True
-    info_json = {"err_code": 0, "err_msg": "[success] submission success"}
+    if stream:
+        yield from iter_json_items(data_dir, fname)
+    else:
+        data = load_json(data_dir, fname)
+        if not isinstance(data, dict):
+            raise TypeError("top-level JSON value is not an object")
+        yield from data.items()
+
+
+def _items(data):
+    """接受已解析的 dict，或 (键, 值) 的可迭代对象。"""
+    return data.items() if hasattr(data, "items") else data
+
+
+def build_gt_index(answers):
+    """作者 ID -> (正常论文 + 异常论文的 ID 列表, 正常论文数)。"""
+    return {
+        aid: (info["normal_data"] + info["outliers"], len(info["normal_data"]))
+        for aid, info in _items(answers)
+    }
+
+
+def load_gt_index(gt_fname, stream=False):
+    """只解析一次答案文件，建立答案索引。"""
+    return build_gt_index(_iter_items(gt_fname, stream))
+
+
+_ERROR_TYPES = [
+    # (错误类别, error_code, err_msg)；有 error_code 的类别会导致评测失败，多余的键只作提示
+    ("missing_authors", 2, "Author ID not in submission file"),
+    ("missing_papers", 3, "Paper ID not in author profile in submission file"),
+    ("non_numeric", 4, "Value error (Not a number)"),
+    ("non_object_authors", 6, "Author profile is not a JSON object"),
+    ("extra_authors", None, "Author ID not in ground truth"),
+    ("extra_papers", None, "Paper ID not in author profile in ground truth"),
+]
+
+
+class _FormatReport:
+    """按类别累计格式问题的精确数量，并保留前 max_examples 个示例。"""
+
+    def __init__(self, max_examples):
+        self.max_examples = max_examples
+        self.counts = {kind: 0 for kind, _, _ in _ERROR_TYPES}
+        self.examples = {kind: [] for kind, _, _ in _ERROR_TYPES}
+
+    def add(self, kind, count, examples):
+        # examples 为惰性可迭代对象，只取需要的前几个
+        self.counts[kind] += count
+        room = self.max_examples - len(self.examples[kind])
+        if room > 0:
+            self.examples[kind].extend(itertools.islice(examples, room))
+
+    def errors(self):
+        return {
+            kind: {"count": self.counts[kind], "err_msg": msg, "examples": self.examples[kind]}
+            for kind, _, msg in _ERROR_TYPES
+            if self.counts[kind]
+        }
+
+    def info_json(self):
+        """返回 (flag, info_json)；只有多余的作者/论文时仍然通过，但在 errors 中列出。"""
+        errors = self.errors()
+        fatal = [(kind, code, msg) for kind, code, msg in _ERROR_TYPES if code and self.counts[kind]]
+        if not fatal:
+            info_json = {"err_code": 0, "err_msg": "[success] submission success"}
+            if errors:
+                info_json["errors"] = errors
+            return True, info_json
+        kind, error_code, err_msg = fatal[0]
+        # error_code / err_msg / other_info 沿用第一类错误的第一个示例，兼容原有日志格式
+        return False, {"error_code": error_code, "err_msg": err_msg,
+                       "other_info": self.examples[kind][0], "errors": errors}
+
 
+def check_submission(submission, gt_index, max_examples=10):
+    """
+    边遍历提交内容边按答案索引做格式检查，并为每个作者生成与索引中论文顺序对齐的
+    float64 预测数组。submission 为已解析的 dict 或 (作者 ID, 预测) 的可迭代对象。
+    不在第一个错误处返回，而是统计全部缺失的作者/论文、非数值预测和多余的键，
+    每类给出总数与前 max_examples 个示例。返回 (flag, info_json, 预测数组)。
+    """
+    pred_arrays = {}
+    seen = set()
+    report = _FormatReport(max_examples)
+    items = iter(_items(submission))
+    while True:
+        # 只有读取/解析文件本身的错误算作 JSON load error
+        try:
+            aid, cur_preds = next(items)
+        except StopIteration:
+            break
+        except (json.JSONDecodeError, UnicodeDecodeError, OSError) as e:
+            info_json = {"error_code": 1, "err_msg": "JSON load error", "other_info": str(e)}
+            return False, info_json, None
+        except TypeError as e:
+            info_json = {"error_code": 5, "err_msg": "Submission is not a JSON object", "other_info": str(e)}
+            return False, info_json, None
+
+        if aid not in gt_index:
+            report.add("extra_authors", 1, ["Author ID: " + aid])
+            continue
+        seen.add(aid)
+        papers, _ = gt_index[aid]
+        if not isinstance(cur_preds, dict):
+            report.add("non_object_authors", 1, ["Author ID: " + aid])
+            continue
+        # 每个作者一次集合差
+        paper_set = set(papers)
+        missing = paper_set.difference(cur_preds)
+        extra = cur_preds.keys() - paper_set
+        if missing:
+            report.add("missing_papers", len(missing),
+                       ("Author ID: " + aid + " Paper ID: " + item for item in papers if item in missing))
+        if extra:
+            report.add("extra_papers", len(extra),
+                       ("Author ID: " + aid + " Paper ID: " + item for item in cur_preds if item in extra))
+        if missing:
+            continue
+        try:
+            pred_arrays[aid] = np.fromiter(map(float, map(cur_preds.__getitem__, papers)),
+                                           dtype=float, count=len(papers))
+        except (TypeError, ValueError):
+            bad = [item for item in papers if not _is_number(cur_preds[item])]
+            report.add("non_numeric", len(bad),
+                       ("Author ID: " + aid + " Paper ID: " + item for item in bad))
+
+    missing_authors = [aid for aid in gt_index if aid not in seen]
+    report.add("missing_authors", len(missing_authors),
+               ("Author ID: " + aid for aid in missing_authors))
+    flag, info_json = report.info_json()
+    if not flag:
+        return False, info_json, None
+    return True, info_json, pred_arrays
+
+
+def load_submission(submit_fname, gt_index, stream=False, max_examples=10):
+    """只解析一次提交文件并做格式检查；stream=True 时按块增量解析。"""
+    return check_submission(_iter_items(submit_fname, stream), gt_index, max_examples)
+
+
+def _is_number(value):
     try:
-        data_dict = load_json(data_dir, submit_fname)
-    except Exception as e:
-        with open(args.l, "w", encoding="utf-8") as f:
-            error_code = 1
-            err_msg = "JSON load error"
-            other_info = str(e)
-            info_json = {"error_code": error_code, "err_msg": err_msg, "other_info": other_info}
-            return False, info_json
-        
-    labels_dict = load_json(data_dir, gt_fname)
-
-    for aid in labels_dict:
-        cur_normal_data = labels_dict[aid]["normal_data"]
-        cur_outliers = labels_dict[aid]["outliers"]
-        for item in cur_normal_data + cur_outliers:
-            if aid not in data_dict:
-                error_code = 2
-                err_msg = "Author ID not in submission file"
-                other_info = "Author ID: " + aid
-                info_json = {"error_code": error_code, "err_msg": err_msg, "other_info": other_info}
-                return False, info_json
-            elif item not in data_dict[aid]:
-                error_code = 3
-                err_msg = "Paper ID not in author profile in submission file"
-                other_info = "Author ID: " + aid + " Paper ID: " + item
-                info_json = {"error_code": error_code, "err_msg": err_msg, "other_info": other_info}
-                return False, info_json
-            else:
-                try:
-                    v = float(data_dict[aid][item])
-                except Exception as e:
-                    error_code = 4
-                    err_msg = "Value error (Not a number)"
-                    other_info = "Author ID: " + aid + " Paper ID: " + item
-                    info_json = {"error_code": error_code, "err_msg": err_msg, "other_info": other_info}
-                    return False, info_json
-    
+        float(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+def format_check(submit_fname, gt_fname, stream=False):
+    gt_index = load_gt_index(gt_fname, stream)
+    flag, info_json, _ = load_submission(submit_fname, gt_index, stream)
     return flag, info_json
 
 
-def cal_overall_auc(submit_fname, gt_fname, log_fname):
-    data_dir = "./"
-    flag, info_json = format_check(submit_fname, gt_fname)
+def segmented_auc(labels, preds, offsets):
+    """
+    每个作者一段的 ROC AUC（与 sklearn 的 roc_auc_score 一致，并列分数取平均秩）。
+    labels/preds 为所有作者拼接后的一维数组，第 i 个作者占 [offsets[i], offsets[i+1])。
+    """
+    labels = np.asarray(labels, dtype=bool)
+    preds = np.asarray(preds, dtype=float)
+    if np.isnan(preds).any():
+        raise ValueError("Input contains NaN.")
+    lengths = np.diff(offsets)
+    segment = np.repeat(np.arange(len(lengths)), lengths)
+
+    # 一次 lexsort：先按作者、再按分数排序
+    order = np.lexsort((preds, segment))
+    sorted_preds, sorted_segment = preds[order], segment[order]
+    sorted_labels = labels[order]
+
+    # 段内并列组：作者或分数变化处开始新组，组内取平均秩（秩从 1 开始）
+    new_group = np.ones(len(order), dtype=bool)
+    new_group[1:] = (sorted_segment[1:] != sorted_segment[:-1]) | (sorted_preds[1:] != sorted_preds[:-1])
+    group = np.cumsum(new_group) - 1
+    group_first = np.flatnonzero(new_group)
+    group_last = np.append(group_first[1:], len(order)) - 1
+    local_rank = np.arange(len(order)) - np.asarray(offsets)[sorted_segment] + 1
+    average_rank = (local_rank[group_first] + local_rank[group_last]) / 2.0
+
+    n_pos = np.bincount(segment, weights=labels, minlength=len(lengths))
+    n_neg = lengths - n_pos
+    if ((n_pos == 0) | (n_neg == 0)).any():
+        raise ValueError(
+            "Only one class present in y_true. ROC AUC score is not defined in that case."
+        )
+    rank_sum = np.bincount(
+        sorted_segment[sorted_labels], weights=average_rank[group[sorted_labels]], minlength=len(lengths)
+    )
+    return (rank_sum - n_pos * (n_pos + 1) / 2.0) / (n_pos * n_neg)
+
+
+def weighted_auc(pred_arrays, gt_index):
+    """按作者异常论文数加权的 AUC；正常论文标签为 1，异常论文为 0。"""
+    lengths = np.array([len(gt_index[aid][0]) for aid in gt_index], dtype=np.int64)
+    n_normal = np.array([gt_index[aid][1] for aid in gt_index], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    labels = np.arange(offsets[-1]) - np.repeat(offsets[:-1], lengths) < np.repeat(n_normal, lengths)
+    preds = np.concatenate([pred_arrays[aid] for aid in gt_index]) if len(gt_index) else np.empty(0)
+    aucs = segmented_auc(labels, preds, offsets)
+    weights = (lengths - n_normal).astype(float)
+    return float(np.sum(weights * aucs) / np.sum(weights))
+
+
+class Result(NamedTuple):
+    """score 为加权 AUC，格式检查未通过时为 None；info_json 为检查结果信息。"""
+    score: Optional[float]
+    info_json: dict
+
+
+def grade(submission, answers, max_examples=10):
+    """
+    对已解析的提交与答案评测，不做任何文件读写，可在常驻进程中反复调用。
+    submission / answers 为 dict，或 (作者 ID, 值) 的可迭代对象（如 iter_json_items）。
+    """
+    gt_index = build_gt_index(answers)
+    flag, info_json, pred_arrays = check_submission(submission, gt_index, max_examples)
     if not flag:
+        return Result(None, info_json)
+    return Result(weighted_auc(pred_arrays, gt_index), info_json)
+
+
+def cal_overall_auc(submit_fname, gt_fname, log_fname, stream=False):
+    result = grade(_iter_items(submit_fname, stream), _iter_items(gt_fname, stream))
+    if result.score is None:
         with open(log_fname, "w", encoding="utf-8") as f:
-            f.writelines(str(info_json))
+            f.writelines(str(result.info_json))
         return 0
 
-    data_dict = load_json(data_dir, submit_fname)
-    labels_dict = load_json(data_dir, gt_fname)
-
-    total_w = 0
-    total_auc = 0
-    for aid in labels_dict:
-        cur_normal_data = labels_dict[aid]["normal_data"]
-        cur_outliers = labels_dict[aid]["outliers"]
-        cur_labels = []
-        cur_preds = []
-        cur_w = len(cur_outliers)
-        for item in cur_normal_data:
-            cur_labels.append(1)
-            cur_preds.append(data_dict[aid][item])
-            # cur_preds.append(1)
-        for item in cur_outliers:
-            cur_labels.append(0)
-            cur_preds.append(data_dict[aid][item])
-            # cur_preds.append(0)
-        cur_auc = roc_auc_score(cur_labels, cur_preds)
-        total_auc += cur_w * cur_auc
-        total_w += cur_w
-    avg_auc = total_auc / total_w
+    # 多余的作者/论文不影响评分，作为附加信息写在 ### 之后
+    warnings = result.info_json.get("errors")
     with open(log_fname, "w", encoding="utf-8") as f:
-        f.writelines(str(avg_auc) + f"###submision success")
+        f.writelines(str(result.score) + f"###submision success" + (f" {warnings}" if warnings else ""))
     return 0
 
 
-parser = argparse.ArgumentParser(description='Test for argparse')
-parser.add_argument('-hp', help='学生提交文件')
-parser.add_argument('-rf',  help='答案文件')
-parser.add_argument('-l',  help='结果文件')
-args = parser.parse_args()
-
-
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')  # include timestamp
+    parser = argparse.ArgumentParser(description='Test for argparse')
+    parser.add_argument('-hp', help='学生提交文件')
+    parser.add_argument('-rf',  help='答案文件')
+    parser.add_argument('-l',  help='结果文件')
+    parser.add_argument('--stream', action='store_true', help='增量解析提交文件与答案文件')
+    args = parser.parse_args()
+
     try:
-        auc = cal_overall_auc(args.hp, args.rf, args.l)
+        auc = cal_overall_auc(args.hp, args.rf, args.l, args.stream)
         print(auc)
     except Exception as e:
         with open(args.l, "w", encoding="utf-8") as f:
@@ -1,8 +1,12 @@
 import json
 import argparse
+import itertools
+
+import numpy as np
 
 """
 python grade.py -hp result.txt -rf qa_valid_flag.txt -l tmp_log.txt
+python grade.py -hp result.txt -rf qa_valid_flag.txt -l tmp_log.txt --stream -k 5 10 20
 """
 
 topk = 20
@@ -11,25 +15,47 @@ topk = 20
 
 # 计算AP
 def calculate_AP(Pq):
-    Rq = sum(Pq)
-    M = len(Pq)
-    AP = 0
-    for k in range(1, M + 1):
-        if Pq[k - 1] == 1:
-            AP += sum(Pq[:k]) / k
-    if Rq == 0:
-        return 0
-    return AP / Rq
+    return float(average_precisions(np.asarray([Pq], dtype=np.uint8))[0])
+
+
+def average_precisions(hits):
+    """
+    批量计算AP
+    :param hits: (n_questions, topk) 的0/1命中矩阵
+    :return: 每个问题的AP, 无命中的问题为0
+    """
+    hits = np.asarray(hits, dtype=np.uint8)
+    if hits.ndim != 2 or hits.shape[0] == 0:
+        return np.zeros(hits.shape[0] if hits.ndim == 2 else 0)
+    ranks = np.arange(1, hits.shape[1] + 1)
+    precision = np.cumsum(hits, axis=1, dtype=np.int64) / ranks
+    # 逐位累加(cumsum按顺序求和), 与逐个k相加的结果完全一致
+    AP = np.cumsum(np.where(hits == 1, precision, 0.0), axis=1)[:, -1]
+    Rq = hits.sum(axis=1, dtype=np.int64)
+    return np.divide(AP, Rq, out=np.zeros_like(AP), where=Rq > 0)
+
+
+def hit_matrix(preds, labels, k=topk):
+    """
+    构造命中矩阵: hits[i, j] = 1 表示第i个问题的第j个预测pid在标准答案中
+    """
+    hits = np.zeros((len(preds), k), dtype=np.uint8)
+    for i, (pred, label) in enumerate(zip(preds, labels)):
+        label = set(label)
+        row = list(map(label.__contains__, pred[:k]))
+        hits[i, :len(row)] = row
+    return hits
+
 
 # 计算MAP
-def calculate_MAP(questions, valid_list):
+def calculate_MAP(questions, valid_list, k=topk):
     # n = len(questions)
-    n = sum(valid_list)
+    valid = np.asarray(valid_list)
+    n = valid.sum().item()
     print("n", n)
-    total_AP = 0
-    for i, q in enumerate(questions):
-        AP = calculate_AP(q)
-        total_AP += (AP * valid_list[i])
+    weighted = average_precisions(np.asarray(questions)[:, :k]) * valid
+    # 按问题顺序累加, 保证与逐个相加的结果一致
+    total_AP = np.cumsum(weighted)[-1].item() if len(weighted) else 0
     MAP = total_AP / n
     return MAP
 
@@ -78,14 +104,103 @@ def format_check(file_path, n_test):
     
     return flag, info_json
 
-def stackex_QA(hp,rf,l):
+def stream_MAP(hp, rf, ks=(topk,)):
+    """
+    流式计算MAP: 提交文件与golden集文件逐行同步读取, 各只读一遍
+    每行到达时即做格式校对, 同时累加各个k下的MAP@k, 每个问题只占用O(1)内存
+    格式错误的优先级与format_check一致: 先报行数错误, 再报第一个取值个数错误
+    :param hp: 选手提交文件
+    :param rf: golden集文件
+    :param ks: 需要计算的k值, 1 <= k <= topk
+    :return:
+        flag: 通过格式检查为True, 反之为False
+        info_json: 检查结果信息
+        maps: {k: MAP@k}, 格式检查未通过时为None
+    """
+    ks = sorted(set(ks))
+    if not ks or ks[0] < 1 or ks[-1] > topk:
+        raise ValueError("k must be within [1, {}]".format(topk))
+    flag = True
+    info_json = {"err_code": 0, "err_msg": "[success] submission success"}
+
+    total_AP = dict.fromkeys(ks, 0)
+    n = 0
+    n_pred = n_test = 0
+    with open(hp, 'r') as fh, open(rf, 'r', encoding='utf8') as fr:
+        for pred_line, gold_line in itertools.zip_longest(fh, fr):
+            if pred_line is not None:
+                n_pred += 1
+            if gold_line is not None:
+                n_test += 1
+            if pred_line is None or gold_line is None or not flag:
+                # 行数不一致或已出现格式错误, 只继续计数
+                continue
+
+            pred = pred_line.strip().split(',')
+            if len(pred) != topk:
+                flag = False
+                info_json = {"err_code": 2, "err_msg": "[file] output {}{} values".format(
+                    '<' if len(pred) < topk else '>', topk)}
+                continue
+
+            gold = json.loads(gold_line.strip())
+            label = set(gold['pids'])
+            valid = gold.get("flag", 1)
+            n += valid
+
+            # 与calculate_AP相同的逐位累加, 在每个k处截断
+            hits = 0
+            AP = 0
+            j = 0
+            for rank, item in enumerate(pred, 1):
+                if item in label:
+                    hits += 1
+                    AP += hits / rank
+                if rank == ks[j]:
+                    total_AP[rank] += (AP / hits if hits else 0) * valid
+                    j += 1
+                    if j == len(ks):
+                        break
+
+    print("n_test", n_test)
+    if n_pred != n_test:
+        info_json = {"err_code": 1, "err_msg": "[file] file {}{} lines".format(
+            '<' if n_pred < n_test else '>', n_test)}
+        return False, info_json, None
+    if not flag:
+        return flag, info_json, None
+    print("n", n)
+    return flag, info_json, {k: total_AP[k] / n for k in ks}
+
+def write_result(l, maps):
+    """
+    写结果文件: 第一行为MAP@topk(或最大的k), 额外的k值逐行追加
+    """
+    main_k = topk if topk in maps else max(maps)
+    with open(l, "w", encoding="utf-8") as f:
+        f.writelines(str(maps[main_k]) + f"###submision success")
+        for k in sorted(maps):
+            if k != main_k:
+                f.write("\nMAP@{}: {}".format(k, maps[k]))
+
+def stackex_QA(hp,rf,l,stream=False,ks=(topk,)):
     """
     计算MAP
     :param hp: 选手提交文件
     :param rf: golden集文件
     :param l: 结果文件,MAP
+    :param stream: 为True时逐行流式读取两个文件, 只读一遍
+    :param ks: 需要计算MAP@k的k值
     :return:
     """
+    if stream:
+        flag_submission, sub_info_json, maps = stream_MAP(hp, rf, ks)
+        if not flag_submission:
+            with open(l, "w", encoding="utf-8") as f:
+                f.writelines(str(sub_info_json))
+            return 0
+        write_result(l, maps)
+        return 0
 
     labels=[]
     valid_list = []
@@ -111,18 +226,10 @@ def stackex_QA(hp,rf,l):
 
 
 
-    questions=[]
-    for pred,label in zip(preds,labels):
-        temp=[0]*topk
-        for idx,item in enumerate(pred):
-            if item in label:
-                temp[idx]=1
-        questions.append(temp)
-    
-    map_score = calculate_MAP(questions, valid_list)
+    questions = hit_matrix(preds, labels)
 
-    with open(l, "w", encoding="utf-8") as f:
-        f.writelines(str(map_score) + f"###submision success")
+    maps = {k: calculate_MAP(questions, valid_list, k) for k in sorted(set(ks))}
+    write_result(l, maps)
     return 0
 
 if __name__ == "__main__":
@@ -131,10 +238,14 @@ if __name__ == "__main__":
     parser.add_argument('-hp', help='学生提交文件')
     parser.add_argument('-rf',  help='答案文件')
     parser.add_argument('-l',  help='结果文件')
+    parser.add_argument('--stream', action='store_true', help='逐行流式读取提交文件与答案文件')
+    parser.add_argument('-k', type=int, nargs='+', default=[topk], help='计算MAP@k的k值, 1<=k<={}'.format(topk))
     args = parser.parse_args()
+    if min(args.k) < 1 or max(args.k) > topk:
+        parser.error('-k must be within [1, {}]'.format(topk))
 
     try:
-        stackex_QA(args.hp, args.rf, args.l)
+        stackex_QA(args.hp, args.rf, args.l, args.stream, args.k)
     except Exception as e:
         with open(args.l, "w", encoding="utf-8") as f:
             f.write(str(e))
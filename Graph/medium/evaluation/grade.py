@@ -1,10 +1,10 @@
-from sklearn.metrics import average_precision_score
+import itertools
 import json
 import argparse
-import warnings
-from lxml import etree
+from typing import NamedTuple, Optional
+
+import numpy as np
 
-warnings.filterwarnings('ignore')
 '''
 System profiling script execution command：
 python grade.py -hp submission_example_valid.json -rf ground_truths_valid.json -l result.log
@@ -21,51 +21,124 @@ def get_real_and_result_dic(real_path, answer_path):
     return real_dic, result_dic
 
 
-def _error(error_info):
-    write_file.write(error_info + '\n')
-    write_file.flush()
-    print("An error has occurred. Please check the error information in the log file!")
-
-
-def calculate_map(result_dic, real_dic):
-    map_list = []
-    for item in result_dic.keys():
-        result_list = result_dic[item]
-        for i in range(len(result_list)):
-            if result_list[i] > 1 or result_list[i] < 0:
-                _error(f"err_code: 1, err_msg: The confidence score does not belong to [0,1]")
-                return None
-            # if result_list[i] >= 0.5:
-            #     result_list[i] = 1
-            # else:
-            #     result_list[i] = 0
-        try:
-            real_list = real_dic[item]
-        except KeyError:
-            _error(f"err_code: 2, err_msg: paper ID {item} does not in evaluted paper set.")
-            return None
-        try:
-            # print(item, len(real_list), len(result_list))
-            map_list.append(average_precision_score(real_list, result_list))
-        except ValueError:
-            _error(f"err_code: 0, the number of references of paper ID {item} mismatches with ground truths.")
-            return None
-    map_ = sum(map_list) / len(map_list)
-    write_file.write(str(map_) + f"###submision success map={map_}\n")
-    return None
+class Result(NamedTuple):
+    """score is the MAP, or None when the submission is rejected with err_msg."""
+    score: Optional[float]
+    err_msg: Optional[str] = None
+
+
+def flatten_scores(result_dic, real_dic):
+    """
+    Concatenate every paper's confidence scores (and the matching ground-truth
+    labels) into flat arrays; paper i occupies [offsets[i], offsets[i+1]).
+    Labels of papers that are missing from real_dic or whose length differs are
+    left as zeros, those papers are reported through `missing` / `mismatch`.
+    """
+    paper_ids = list(result_dic.keys())
+    lengths = np.fromiter((len(result_dic[item]) for item in paper_ids), dtype=np.int64, count=len(paper_ids))
+    offsets = np.zeros(len(paper_ids) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    scores = np.fromiter(
+        itertools.chain.from_iterable(result_dic[item] for item in paper_ids), dtype=float, count=offsets[-1]
+    )
+
+    missing = np.array([item not in real_dic for item in paper_ids], dtype=bool)
+    real_lengths = np.array([len(real_dic[item]) if item in real_dic else -1 for item in paper_ids], dtype=np.int64)
+    # average_precision_score also rejects empty papers
+    mismatch = ~missing & ((real_lengths != lengths) | (lengths == 0))
+    labels = np.zeros(offsets[-1], dtype=float)
+    for i in np.flatnonzero(~missing & ~mismatch):
+        labels[offsets[i]:offsets[i + 1]] = real_dic[paper_ids[i]]
+    return paper_ids, scores, labels, offsets, missing, mismatch
+
+
+def segmented_average_precision(labels, scores, offsets):
+    """
+    Per-paper average precision, equal to sklearn's average_precision_score:
+    tied scores form a single threshold, and a paper without positive
+    references scores 0.
+    """
+    lengths = np.diff(offsets)
+    segment = np.repeat(np.arange(len(lengths)), lengths)
+
+    # one lexsort: by paper, then by descending score
+    order = np.lexsort((-scores, segment))
+    sorted_scores, sorted_segment = scores[order], segment[order]
+    sorted_labels = labels[order]
+
+    tps = np.cumsum(sorted_labels)
+    tps -= np.concatenate([[0.0], tps])[offsets[:-1]][sorted_segment]
+    ranks = np.arange(1, len(order) + 1) - offsets[:-1][sorted_segment]
 
+    # a threshold closes where the paper or the score changes
+    is_last = np.ones(len(order), dtype=bool)
+    is_last[:-1] = (sorted_segment[1:] != sorted_segment[:-1]) | (sorted_scores[1:] != sorted_scores[:-1])
+    last = np.flatnonzero(is_last)
+    last_segment = sorted_segment[last]
+    step_tps = np.diff(np.concatenate([[0.0], tps[last]]))
+    first_of_paper = np.ones(len(last), dtype=bool)
+    first_of_paper[1:] = last_segment[1:] != last_segment[:-1]
+    step_tps[first_of_paper] = tps[last][first_of_paper]
+
+    precision = tps[last] / ranks[last]
+    weighted = np.bincount(last_segment, weights=step_tps * precision, minlength=len(lengths))
+    n_pos = np.bincount(segment, weights=labels, minlength=len(lengths))
+    return np.divide(weighted, n_pos, out=np.zeros(len(lengths)), where=n_pos > 0)
+
+
+def grade(submission, answers):
+    """
+    Grade a parsed submission ({paper ID: [confidence, ...]}) against the parsed
+    ground truths ({paper ID: [0/1, ...]}). No file I/O and no global state, so it
+    can be called repeatedly from a long-lived process.
+    """
+    result_dic, real_dic = submission, answers
+    paper_ids, scores, labels, offsets, missing, mismatch = flatten_scores(result_dic, real_dic)
+    segment = np.repeat(np.arange(len(paper_ids)), np.diff(offsets))
+
+    out_of_range = np.zeros(len(paper_ids), dtype=bool)
+    out_of_range[segment[(scores > 1) | (scores < 0)]] = True
+    # average_precision_score refuses NaN scores and labels other than 0/1
+    invalid = np.zeros(len(paper_ids), dtype=bool)
+    invalid[segment[np.isnan(scores) | ((labels != 0) & (labels != 1))]] = True
+    mismatch |= invalid & ~missing
+
+    # report the first bad paper, in the same order the per-paper loop used
+    bad = np.flatnonzero(out_of_range | missing | mismatch)
+    if len(bad):
+        i = bad[0]
+        if out_of_range[i]:
+            return Result(None, f"err_code: 1, err_msg: The confidence score does not belong to [0,1]")
+        if missing[i]:
+            return Result(None, f"err_code: 2, err_msg: paper ID {paper_ids[i]} does not in evaluted paper set.")
+        return Result(None, f"err_code: 0, the number of references of paper ID {paper_ids[i]} mismatches with ground truths.")
+
+    map_list = segmented_average_precision(labels, scores, offsets)
+    map_ = sum(map_list.tolist()) / len(map_list)
+    return Result(map_)
+
+
+def calculate_map(result_dic, real_dic, write_file):
+    result = grade(result_dic, real_dic)
+    if result.score is None:
+        write_file.write(result.err_msg + '\n')
+        write_file.flush()
+        print("An error has occurred. Please check the error information in the log file!")
+        return None
+    write_file.write(str(result.score) + f"###submision success map={result.score}\n")
+    return None
 
-parser = argparse.ArgumentParser(description='input argparse')
-parser.add_argument('-hp', help='submit file', default='test.json')
-parser.add_argument('-rf', help='answer file', default='real_dic.json')
-parser.add_argument('-l', help='result file', default='result.log')
-args = parser.parse_args()
 
 if __name__ == '__main__':
     """
     using: python3 eval_f1.py -hp result.txt -rf true_result.txt -l res.log
     """
-    write_file = open(args.l, 'w')
-    real_dic, result_dic = get_real_and_result_dic(args.rf, args.hp)
-    calculate_map(result_dic, real_dic)
-    write_file.close()
+    parser = argparse.ArgumentParser(description='input argparse')
+    parser.add_argument('-hp', help='submit file', default='test.json')
+    parser.add_argument('-rf', help='answer file', default='real_dic.json')
+    parser.add_argument('-l', help='result file', default='result.log')
+    args = parser.parse_args()
+
+    with open(args.l, 'w') as write_file:
+        real_dic, result_dic = get_real_and_result_dic(args.rf, args.hp)
+        calculate_map(result_dic, real_dic, write_file)
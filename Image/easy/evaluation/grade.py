@@ -1,5 +1,12 @@
+import argparse
+import contextlib
+import itertools
+import os
+from typing import Mapping, Tuple
+
+import numpy as np
+import pandas as pd
 from pandas import DataFrame
-from sklearn.metrics import root_mean_squared_error
 
 class InvalidSubmissionError(Exception):
     """
@@ -8,7 +15,99 @@ class InvalidSubmissionError(Exception):
 
     pass
 
-def grade(submission: DataFrame, answers: DataFrame) -> float:
+# `image_row_col` ids are packed as image << 40 | row << 20 | col
+_ROW_BITS = 20
+_COL_BITS = 20
+
+
+def parse_pixel_ids(ids: pd.Series) -> np.ndarray:
+    """
+    Splits `image_row_col` ids into an (n, 3) int32 array of (image, row, col).
+    """
+    # Concatenate the ids into one byte buffer and gather it into a zero-padded
+    # (width, n) array, so every later step loops over the id width, never the rows
+    ids = ids.astype(str).tolist()
+    data = np.frombuffer("".join(ids).encode("ascii"), dtype=np.uint8)
+    lengths = np.fromiter(map(len, ids), dtype=np.int64, count=len(ids))
+    offsets = np.cumsum(lengths) - lengths
+    width = int(lengths.max(initial=0))
+    data = np.append(data, np.uint8(0))  # padding byte for ids shorter than `width`
+    chars = np.empty((width, len(ids)), dtype=np.uint8)
+    for j in range(width):
+        np.take(data, np.where(lengths > j, offsets + j, len(data) - 1), out=chars[j])
+
+    is_separator = chars == ord("_")
+    is_digit = (chars >= ord("0")) & (chars <= ord("9"))
+    if not (is_digit | is_separator | (chars == 0)).all():
+        raise ValueError("ids must look like 'image_row_col'")
+
+    # Horner's rule down the character columns, flushing the number at each separator
+    triples = np.zeros((3, len(ids)), dtype=np.int64)
+    n_digits = np.zeros((3, len(ids)), dtype=np.int8)
+    number = np.zeros(len(ids), dtype=np.int64)
+    run = np.zeros(len(ids), dtype=np.int8)
+    field = np.zeros(len(ids), dtype=np.int8)
+    for column, digit, separator in zip(chars, is_digit, is_separator):
+        if separator.any():
+            for f in range(2):
+                flush = separator & (field == f)
+                np.copyto(triples[f], number, where=flush)
+                np.copyto(n_digits[f], run, where=flush)
+            field += separator
+            if (field > 2).any():
+                raise ValueError("ids must look like 'image_row_col'")
+            np.copyto(number, 0, where=separator)
+            np.copyto(run, 0, where=separator)
+        np.copyto(number, number * 10 + column - ord("0"), where=digit)
+        run += digit
+        if (run > 9).any():
+            raise ValueError("image, row and col are out of range")
+    triples[2] = number
+    n_digits[2] = run
+    if (field != 2).any() or (n_digits == 0).any():
+        raise ValueError("ids must look like 'image_row_col'")
+
+    if (triples[1:] >= 1 << _ROW_BITS).any() or (
+        triples[0] >= 1 << (63 - _ROW_BITS - _COL_BITS)
+    ).any():
+        raise ValueError("image, row and col are out of range")
+    return triples.T.astype(np.int32)
+
+
+def pixel_keys(ids: pd.Series) -> np.ndarray:
+    """
+    Packs `image_row_col` ids into int64 keys that sort by image, then row, then col.
+    """
+    triples = parse_pixel_ids(ids).astype(np.int64)
+    return (triples[:, 0] << (_ROW_BITS + _COL_BITS)) | (triples[:, 1] << _COL_BITS) | triples[:, 2]
+
+
+def format_pixel_keys(keys: np.ndarray) -> list:
+    image = keys >> (_ROW_BITS + _COL_BITS)
+    row = (keys >> _COL_BITS) & ((1 << _ROW_BITS) - 1)
+    col = keys & ((1 << _COL_BITS) - 1)
+    return [f"{i}_{r}_{c}" for i, r, c in zip(image, row, col)]
+
+
+def _rmse_breakdown(images: list, squared_errors: list) -> Tuple[float, DataFrame]:
+    # squared_errors[i] holds image i's float64 squared errors in row-major pixel order; both
+    # the CSV and the array paths reduce them the same way so their scores agree exactly
+    sums = [float(np.sum(errors)) for errors in squared_errors]
+    counts = [errors.size for errors in squared_errors]
+    breakdown = DataFrame(
+        {
+            "image": images,
+            "pixels": counts,
+            "rmse": [np.sqrt(s / c) if c else np.nan for s, c in zip(sums, counts)],
+        }
+    )
+    return float(np.sqrt(sum(sums) / sum(counts))), breakdown
+
+
+def grade_with_breakdown(submission: DataFrame, answers: DataFrame) -> Tuple[float, DataFrame]:
+    """
+    RMSE of the submission, plus a per-image RMSE DataFrame.
+    """
     assert "id" in answers.columns, "Answers must have an 'id' column."
     assert "value" in answers.columns, "Answers must have a 'value' column."
 
@@ -33,33 +132,215 @@ def grade(submission: DataFrame, answers: DataFrame) -> float:
             f"Expected the submission to have {len(answers)} rows, but got {len(submission)}."
         )
 
-    submission_sorted = submission.sort_values(by="id").sort_index(axis=1)
-    answers_sorted = answers.sort_values(by="id").sort_index(axis=1)
+    try:
+        submission_keys = pixel_keys(submission["id"])
+    except ValueError as e:
+        raise InvalidSubmissionError(f"Submission has malformed 'id' values: {e}")
+    answer_keys = pixel_keys(answers["id"])
 
-    if (submission_sorted["id"].values != answers_sorted["id"].values).any():
+    submission_order = np.argsort(submission_keys, kind="stable")
+    answer_order = np.argsort(answer_keys, kind="stable")
+    submission_sorted = submission_keys[submission_order]
+    answer_sorted = answer_keys[answer_order]
+    if not np.array_equal(submission_sorted, answer_sorted):
+        duplicated = np.unique(submission_sorted[1:][submission_sorted[1:] == submission_sorted[:-1]])
+        missing = np.setdiff1d(answer_sorted, submission_sorted)
+        extra = np.setdiff1d(submission_sorted, answer_sorted)
+        problems = [
+            f"{len(keys)} {kind} (e.g. {', '.join(format_pixel_keys(keys[:5]))})"
+            for kind, keys in (("duplicated", duplicated), ("missing", missing), ("extra", extra))
+            if len(keys)
+        ]
         raise InvalidSubmissionError(
-            "Expected the submission to have the same 'id' values as the answers, but they differ."
+            "Expected the submission to have the same 'id' values as the answers, but they "
+            f"differ: {'; '.join(problems)}."
         )
 
-    y_true = submission_sorted["value"]
-    y_pred = answers_sorted["value"]
-    score = root_mean_squared_error(y_true=y_true, y_pred=y_pred)
+    # Equal sorted keys, so both value columns line up pixel by pixel
+    y_pred = submission["value"].to_numpy(dtype=float)[submission_order]
+    y_true = answers["value"].to_numpy(dtype=float)[answer_order]
+    squared_errors = (y_pred - y_true) ** 2
+
+    image_of_pixel = answer_sorted >> (_ROW_BITS + _COL_BITS)
+    starts = np.flatnonzero(np.diff(image_of_pixel, prepend=-1))
+    ends = np.append(starts[1:], len(image_of_pixel))
+    score, breakdown = _rmse_breakdown(
+        [str(image) for image in image_of_pixel[starts]],
+        [squared_errors[start:end] for start, end in zip(starts, ends)],
+    )
+
+    return score, breakdown
+
 
+def grade(submission: DataFrame, answers: DataFrame) -> float:
+    score, _ = grade_with_breakdown(submission, answers)
     return score
 
-import pandas as pd
-answers = pd.read_csv("answers.csv")
-
-# 2. 读取用户提交的文件（预测值）
-submission = pd.read_csv("openhandsds/submission.csv")
-
-# 3. 调用评分函数
-try:
-    score = grade(submission, answers)
-    print(f"✅ 评分成功！RMSE 得分: {score:.6f}")
-except InvalidSubmissionError as e:
-    print(f"❌ 提交无效：{e}")
-except FileNotFoundError as e:
-    print(f"📁 文件未找到：{e}")
-except Exception as e:
-    print(f"⚠️ 其他错误：{e}")
+
+def _read_chunks(path: str, chunksize: int):
+    return pd.read_csv(path, usecols=["id", "value"], dtype={"id": str}, chunksize=chunksize)
+
+
+def grade_streaming(submission_path: str, answers_path: str, chunksize: int = 1_000_000) -> float:
+    """
+    RMSE over submission and answers CSVs that list the pixels in the same row order,
+    read in aligned chunks of `chunksize` rows so that only a few chunks are held in memory.
+    """
+    try:
+        submission_chunks = _read_chunks(submission_path, chunksize)
+    except ValueError as e:
+        raise InvalidSubmissionError(f"Submission must have 'id' and 'value' columns: {e}")
+    answer_chunks = _read_chunks(answers_path, chunksize)
+
+    squared_error = 0.0
+    n_rows = 0
+    for sub_chunk, ans_chunk in itertools.zip_longest(submission_chunks, answer_chunks):
+        offset = n_rows
+        n_sub = offset + (0 if sub_chunk is None else len(sub_chunk))
+        n_ans = offset + (0 if ans_chunk is None else len(ans_chunk))
+        if n_sub > n_ans:
+            raise InvalidSubmissionError(
+                f"Expected the submission to have {n_ans} rows, but it has more "
+                f"(chunk starting at row {offset})."
+            )
+        if n_sub < n_ans:
+            raise InvalidSubmissionError(
+                f"Expected the submission to have at least {n_ans} rows, but it ends after "
+                f"{n_sub} rows (chunk starting at row {offset})."
+            )
+
+        mismatch = sub_chunk["id"].to_numpy() != ans_chunk["id"].to_numpy()
+        if mismatch.any():
+            i = int(np.argmax(mismatch))
+            raise InvalidSubmissionError(
+                f"Expected the submission to have the same 'id' values as the answers, but got "
+                f"'{sub_chunk['id'].iloc[i]}' instead of '{ans_chunk['id'].iloc[i]}' on row "
+                f"{offset + i} (chunk starting at row {offset})."
+            )
+
+        y_pred = pd.to_numeric(sub_chunk["value"], errors="coerce").to_numpy(dtype=float)
+        if np.isnan(y_pred).any():
+            i = int(np.argmax(np.isnan(y_pred)))
+            raise InvalidSubmissionError(
+                f"Submission must have float values in the 'value' column, but row {offset + i} "
+                f"(chunk starting at row {offset}) is '{sub_chunk['value'].iloc[i]}'."
+            )
+        y_true = ans_chunk["value"].to_numpy(dtype=float)
+        diff = y_pred - y_true
+        squared_error += float(np.dot(diff, diff))
+        n_rows += len(diff)
+
+    if n_rows == 0:
+        raise InvalidSubmissionError("Submission and answers have no rows.")
+    return float(np.sqrt(squared_error / n_rows))
+
+
+def unmelt(df: DataFrame) -> dict:
+    """
+    Rebuilds {image id: (rows, cols) float64 array} from a pixel-melted `id,value` frame.
+    """
+    triples = parse_pixel_ids(df["id"])
+    values = df["value"].to_numpy(dtype=float)
+    order = np.argsort(triples[:, 0], kind="stable")
+    triples, values = triples[order], values[order]
+    starts = np.flatnonzero(np.diff(triples[:, 0], prepend=-1))
+    images = {}
+    for start, end in zip(starts, np.append(starts[1:], len(triples))):
+        rows, cols = triples[start:end, 1], triples[start:end, 2]
+        image = np.full((rows.max(), cols.max()), np.nan)
+        image[rows - 1, cols - 1] = values[start:end]
+        images[str(triples[start, 0])] = image
+    return images
+
+
+def load_image_arrays(path: str) -> Mapping[str, np.ndarray]:
+    """
+    Opens an `.npz` archive or a directory of `<image id>.npy` files as {image id: array}.
+    Directory members are memory-mapped; archive members are read lazily one at a time.
+    """
+    if os.path.isdir(path):
+        return {
+            name[: -len(".npy")]: np.load(os.path.join(path, name), mmap_mode="r")
+            for name in os.listdir(path)
+            if name.endswith(".npy")
+        }
+    if path.endswith(".npz"):
+        return np.load(path)
+    return unmelt(pd.read_csv(path, dtype={"id": str}))
+
+
+def grade_arrays(submission_path: str, answers_path: str) -> Tuple[float, DataFrame]:
+    """
+    RMSE of a dense submission (`.npz` or directory of `.npy`, one (rows, cols) array per test
+    image id) against ground-truth arrays in either form or the melted answers CSV. Returns
+    the score, equal to the CSV path on the same values, and a per-image RMSE DataFrame.
+    """
+    with contextlib.ExitStack() as opened:
+        try:
+            submission = load_image_arrays(submission_path)
+        except (OSError, ValueError) as e:
+            raise InvalidSubmissionError(f"Submission arrays could not be read: {e}")
+        # `.npz` archives hold an open file handle until closed
+        if hasattr(submission, "close"):
+            opened.callback(submission.close)
+        answers = load_image_arrays(answers_path)
+        if hasattr(answers, "close"):
+            opened.callback(answers.close)
+
+        missing = sorted(set(answers.keys()) - set(submission.keys()))
+        extra = sorted(set(submission.keys()) - set(answers.keys()))
+        if missing or extra:
+            raise InvalidSubmissionError(
+                f"Expected the submission to have one array per image id, but {len(missing)} are "
+                f"missing (e.g. {missing[:5]}) and {len(extra)} are extra (e.g. {extra[:5]})."
+            )
+
+        images = sorted(answers.keys(), key=lambda image: (len(image), image))
+        squared_errors = []
+        for image in images:
+            y_true = np.asarray(answers[image], dtype=float)
+            y_pred = np.asarray(submission[image])
+            if y_pred.shape != y_true.shape:
+                raise InvalidSubmissionError(
+                    f"Expected image {image} to have shape {y_true.shape}, but got {y_pred.shape}."
+                )
+            if not np.issubdtype(y_pred.dtype, np.floating) or not np.isfinite(y_pred).all():
+                raise InvalidSubmissionError(f"Image {image} must hold finite float values.")
+            squared_errors.append(((y_pred.astype(float) - y_true) ** 2).ravel())
+        return _rmse_breakdown(images, squared_errors)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="RMSE grader for denoising-dirty-documents")
+    parser.add_argument("--submission", default="openhandsds/submission.csv", help="submission file")
+    parser.add_argument("--answers", default="answers.csv", help="answer file")
+    parser.add_argument("--stream", action="store_true",
+                        help="grade in aligned chunks; rows must be in the answers' order")
+    parser.add_argument("--chunksize", type=int, default=1_000_000, help="rows per chunk")
+    parser.add_argument("--per-image", action="store_true", help="print the RMSE of every image")
+    args = parser.parse_args()
+
+    try:
+        breakdown = None
+        if os.path.isdir(args.submission) or args.submission.endswith(".npz"):
+            score, breakdown = grade_arrays(args.submission, args.answers)
+        elif args.stream:
+            score = grade_streaming(args.submission, args.answers, args.chunksize)
+        else:
+            # 1. 读取答案文件（真实值）
+            answers = pd.read_csv(args.answers)
+
+            # 2. 读取用户提交的文件（预测值）
+            submission = pd.read_csv(args.submission)
+
+            # 3. 调用评分函数
+            score, breakdown = grade_with_breakdown(submission, answers)
+        if args.per_image and breakdown is not None:
+            print(breakdown.to_string(index=False))
+        print(f"✅ 评分成功！RMSE 得分: {score:.6f}")
+    except InvalidSubmissionError as e:
+        print(f"❌ 提交无效：{e}")
+    except FileNotFoundError as e:
+        print(f"📁 文件未找到：{e}")
+    except Exception as e:
+        print(f"⚠️ 其他错误：{e}")
@@ -1,33 +1,80 @@
 import numpy as np
 import pandas as pd
 import itertools
-import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 from sklearn.metrics import mean_squared_error
 from scipy.spatial.transform import Rotation as R
 from scipy.linalg import svd
 
-def load_submission(file_path):
+POSE_COLUMNS = [f'R{i}{j}' for i in range(3) for j in range(3)] + ['T0', 'T1', 'T2']
+SCENE_KEYS = ['dataset', 'scene']
+
+def _parse_native_poses(df, name):
+    # Native IMC 2024 format: image_path / image_name, dataset, scene and ';'-separated
+    # rotation_matrix (row-major 3x3) and translation_vector columns. Unregistered images
+    # carry 'nan' entries.
+    id_column = next((c for c in ('image_path', 'image_name', 'image_id') if c in df.columns), None)
+    required_columns = SCENE_KEYS + ['rotation_matrix', 'translation_vector']
+    if id_column is None or not all(col in df.columns for col in required_columns):
+        raise ValueError(f'{name} missing required columns: image_path, {", ".join(required_columns)}')
+    # Every row holds exactly 9 rotation / 3 translation values, or a bare 'nan'
+    for column, size in (('rotation_matrix', 9), ('translation_vector', 3)):
+        values = df[column].fillna('nan').astype(str).str.strip()
+        valid = (values.str.count(';') == size - 1) | (values.str.lower() == 'nan')
+        if not valid.all():
+            bad = df.loc[~valid, id_column].iloc[0]
+            raise ValueError(f'{name} must have 9 rotation and 3 translation values per row '
+                             f'(or a bare nan); {column} of {bad} has '
+                             f'{values[~valid].iloc[0].count(";") + 1}')
+    try:
+        rotations = df['rotation_matrix'].astype(str).str.split(';', expand=True).astype(float)
+        translations = df['translation_vector'].astype(str).str.split(';', expand=True).astype(float)
+    except ValueError as e:
+        raise ValueError(f'{name} has non-numeric pose values: {e}')
+    # A bare 'nan' leaves the remaining entries missing, which marks the image unregistered
+    rotations = rotations.reindex(columns=range(9))
+    translations = translations.reindex(columns=range(3))
+    poses = pd.DataFrame(np.hstack([rotations.to_numpy(), translations.to_numpy()]),
+                         columns=POSE_COLUMNS, index=df.index)
+    # Images are matched inside a scene by file name, so image_path and image_name agree
+    image_id = df[id_column].astype(str).str.rsplit('/', n=1).str[-1]
+    return pd.concat([df[SCENE_KEYS].astype(str), image_id.rename('image_id'), poses], axis=1)
+
+def _load_poses(file_path, name):
     df = pd.read_csv(file_path)
-    required_columns = ['image_id'] + [f'R{i}{j}' for i in range(3) for j in range(3)] + ['T0', 'T1', 'T2']
+    if 'rotation_matrix' in df.columns:
+        return _parse_native_poses(df, name)
+    required_columns = ['image_id'] + POSE_COLUMNS
     if not all(col in df.columns for col in required_columns):
-        raise ValueError(f'Submission missing required columns: {required_columns}')
+        raise ValueError(f'{name} missing required columns: {required_columns}')
+    for key in SCENE_KEYS:
+        df[key] = df[key].astype(str) if key in df.columns else ''
     return df
 
+def load_submission(file_path):
+    return _load_poses(file_path, 'Submission')
+
 def load_ground_truth(file_path):
-    df = pd.read_csv(file_path)
-    required_columns = ['image_id'] + [f'R{i}{j}' for i in range(3) for j in range(3)] + ['T0', 'T1', 'T2']
-    if not all(col in df.columns for col in required_columns):
-        raise ValueError(f'Ground truth missing required columns: {required_columns}')
-    return df
+    return _load_poses(file_path, 'Ground truth')
 
 def get_camera_centers(df):
-    centers = {}
-    for _, row in df.iterrows():
-        R_matrix = np.array(row[[f'R{i}{j}' for i in range(3) for j in range(3)]]).reshape(3, 3)
-        T_vec = np.array(row[['T0', 'T1', 'T2']]).reshape(3, 1)
-        C = -R_matrix.T @ T_vec
-        centers[row['image_id']] = C.flatten()
-    return centers
+    """
+    Camera centers C = -R^T T for every row, as an (N, 3) float frame indexed by image_id.
+    The first pose wins for duplicated ids.
+    """
+    poses = df[POSE_COLUMNS].to_numpy(dtype=float)
+    R_matrices = poses[:, :9].reshape(-1, 3, 3)
+    centers = -np.einsum('nji,nj->ni', R_matrices, poses[:, 9:])
+    centers = pd.DataFrame(centers, index=pd.Index(df['image_id'], name='image_id'),
+                           columns=['x', 'y', 'z'])
+    return centers[~centers.index.duplicated()]
+
+def _as_center_frame(centers):
+    if isinstance(centers, pd.DataFrame):
+        return centers
+    return pd.DataFrame.from_dict({k: np.ravel(v) for k, v in centers.items()}, orient='index',
+                                  columns=['x', 'y', 'z'])
 
 def compute_similarity_transform(src, dst):
     # Based on Umeyama method
@@ -50,47 +97,215 @@ def compute_similarity_transform(src, dst):
 def apply_similarity_transform(C, scale, R_opt, t_opt):
     return scale * R_opt @ C + t_opt
 
-def evaluate(pred_centers, gt_centers, threshold=0.5):
-    common_ids = set(pred_centers.keys()) & set(gt_centers.keys())
-    best_inliers = 0
-    best_transform = None
-    for triplet in itertools.combinations(common_ids, 3):
-        src = [pred_centers[i] for i in triplet]
-        dst = [gt_centers[i] for i in triplet]
-        try:
-            scale, R_opt, t_opt = compute_similarity_transform(src, dst)
-        except:
-            continue
-        inliers = 0
-        for img_id in common_ids:
-            pred_C = pred_centers[img_id].reshape(3, 1)
-            pred_transformed = apply_similarity_transform(pred_C, scale, R_opt, t_opt).flatten()
-            gt_C = gt_centers[img_id]
-            if np.linalg.norm(pred_transformed - gt_C) < threshold:
-                inliers += 1
-        if inliers > best_inliers:
-            best_inliers = inliers
-            best_transform = (scale, R_opt, t_opt)
-
-    maa = best_inliers / len(common_ids) if common_ids else 0.0
-    return maa, best_transform
-
-def main(submission_path, ground_truth_path):
+def compute_similarity_transforms(src, dst):
+    """
+    Batched Umeyama: src, dst are (K, 3, 3) arrays holding K triplets of 3D points.
+    Returns scales (K,), rotations (K, 3, 3) and translations (K, 3). Degenerate
+    triplets yield non-finite scales and therefore never produce inliers.
+    """
+    src = np.asarray(src, dtype=float)
+    dst = np.asarray(dst, dtype=float)
+    mean_src = src.mean(axis=1, keepdims=True)
+    mean_dst = dst.mean(axis=1, keepdims=True)
+    src_centered = src - mean_src
+    dst_centered = dst - mean_dst
+    H = np.einsum('kpi,kpj->kij', src_centered, dst_centered)
+    U, _, Vt = np.linalg.svd(H)
+    V = np.swapaxes(Vt, 1, 2)
+    Ut = np.swapaxes(U, 1, 2)
+    # Flip the last singular direction where the plain solution is a reflection
+    d = np.sign(np.linalg.det(V @ Ut))
+    d[d == 0] = 1
+    V[:, :, 2] *= d[:, None]
+    R_opt = V @ Ut
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scale = np.einsum('kii->k', R_opt @ H) / np.einsum('kpi,kpi->k', src_centered, src_centered)
+    t_opt = mean_dst[:, 0] - scale[:, None] * np.einsum('kij,kj->ki', R_opt, mean_src[:, 0])
+    return scale, R_opt, t_opt
+
+def transform_residuals(pred, gt, scale, R_opt, t_opt):
+    """
+    Distances between every transformed predicted center and its ground truth.
+    pred, gt: (N, 3); scale, R_opt, t_opt as returned by compute_similarity_transforms.
+    Returns a (K, N) array.
+    """
+    with np.errstate(invalid='ignore', over='ignore'):
+        transformed = scale[:, None, None] * np.einsum('kij,nj->kni', R_opt, pred) + t_opt[:, None, :]
+        return np.linalg.norm(transformed - gt[None], axis=2)
+
+def _inlier_counts(residuals, thresholds):
+    # One stable sort per candidate of its residuals merged with the (ascending) thresholds;
+    # a threshold's position in that order minus its own index is the number of residuals
+    # strictly below it. Ties sort the threshold first and NaN residuals sort last.
+    K, T = residuals.shape[0], len(thresholds)
+    merged = np.concatenate([np.broadcast_to(thresholds, (K, T)), residuals], axis=1)
+    order = np.argsort(merged, axis=1, kind='stable')
+    positions = np.nonzero(order < T)[1].reshape(K, T)
+    return positions - np.arange(T)
+
+def _score_batch(pred, gt, triplets, thresholds):
+    # triplets: (K, 3) indices into pred / gt; returns the best inlier count and transform
+    # for every threshold
+    scale, R_opt, t_opt = compute_similarity_transforms(pred[triplets], gt[triplets])
+    residuals = transform_residuals(pred, gt, scale, R_opt, t_opt)
+    inliers = _inlier_counts(residuals, thresholds)
+    best = np.argmax(inliers, axis=0)
+    transforms = [(scale[k], R_opt[k], t_opt[k].reshape(3, 1)) for k in best]
+    return inliers[best, np.arange(len(thresholds))], transforms
+
+def _exhaustive_batches(n, batch_size):
+    triplets = itertools.combinations(range(n), 3)
+    while True:
+        batch = np.fromiter(itertools.chain.from_iterable(itertools.islice(triplets, batch_size)),
+                            dtype=np.intp)
+        if batch.size == 0:
+            return
+        yield batch.reshape(-1, 3)
+
+def _random_batch(rng, n, size):
+    triplets = np.empty((0, 3), dtype=np.intp)
+    while len(triplets) < size:
+        draw = rng.integers(0, n, size=(size, 3))
+        distinct = (draw[:, 0] != draw[:, 1]) & (draw[:, 0] != draw[:, 2]) & (draw[:, 1] != draw[:, 2])
+        triplets = np.concatenate([triplets, draw[distinct]])
+    return triplets[:size]
+
+def _ransac_converged(iteration, inlier_ratio, confidence):
+    # Number of draws needed to hit an all-inlier triplet with probability `confidence`
+    if inlier_ratio <= 0:
+        return False
+    if inlier_ratio >= 1:
+        return True
+    return iteration >= np.log(1 - confidence) / np.log(1 - inlier_ratio ** 3)
+
+def evaluate_thresholds(pred_centers, gt_centers, thresholds, strategy='auto', max_iters=1000,
+                        seed=0, confidence=0.999, batch_size=256):
+    """
+    Scores every threshold from the same set of candidate transforms. Centers are frames
+    from get_camera_centers (or {image_id: center} dicts). Returns the mean
+    accuracy over `thresholds` (sorted ascending), the per-threshold accuracies and the
+    best transform for each threshold.
+
+    strategy: 'exhaustive' tries every triplet; 'ransac' samples at most `max_iters` random
+    triplets with `seed` and stops early once an all-inlier triplet has been drawn with
+    probability `confidence` at every threshold; 'auto' is exhaustive when the scene has no
+    more than `max_iters` triplets and ransac otherwise. Both score `batch_size` triplets at
+    a time.
+    """
+    if strategy not in ('auto', 'exhaustive', 'ransac'):
+        raise ValueError(f"Unknown strategy: {strategy}")
+    thresholds = np.sort(np.atleast_1d(np.asarray(thresholds, dtype=float)))
+    if thresholds.size == 0:
+        raise ValueError("At least one threshold is required")
+    pred_centers = _as_center_frame(pred_centers)
+    gt_centers = _as_center_frame(gt_centers)
+    common_ids = gt_centers.index.intersection(pred_centers.index).sort_values()
+    n = len(common_ids)
+    if n == 0:
+        return 0.0, np.zeros(len(thresholds)), [None] * len(thresholds)
+
+    pred = pred_centers.loc[common_ids].to_numpy(dtype=float)  # N×3
+    gt = gt_centers.loc[common_ids].to_numpy(dtype=float)
+    # Unregistered images (nan poses) count against the accuracy but are never sampled
+    registered = np.flatnonzero(np.isfinite(pred).all(axis=1) & np.isfinite(gt).all(axis=1))
+    m = len(registered)
+    if strategy == 'auto':
+        n_triplets = m * (m - 1) * (m - 2) // 6
+        strategy = 'exhaustive' if n_triplets <= max_iters else 'ransac'
+
+    best_inliers = np.zeros(len(thresholds), dtype=int)
+    best_transforms = [None] * len(thresholds)
+
+    def update(triplets):
+        inliers, transforms = _score_batch(pred, gt, registered[triplets], thresholds)
+        for j in np.nonzero(inliers > best_inliers)[0]:
+            best_inliers[j] = inliers[j]
+            best_transforms[j] = transforms[j]
+
+    if strategy == 'exhaustive':
+        for triplets in _exhaustive_batches(m, batch_size):
+            update(triplets)
+    elif m >= 3:
+        rng = np.random.default_rng(seed)
+        drawn = 0
+        while drawn < max_iters and not _ransac_converged(drawn, best_inliers.min() / m, confidence):
+            triplets = _random_batch(rng, m, min(batch_size, max_iters - drawn))
+            drawn += len(triplets)
+            update(triplets)
+
+    accuracies = best_inliers / n
+    return float(accuracies.mean()), accuracies, best_transforms
+
+def evaluate(pred_centers, gt_centers, threshold=0.5, **kwargs):
+    """Single-threshold mAA; see evaluate_thresholds for the search options."""
+    maa, _, best_transforms = evaluate_thresholds(pred_centers, gt_centers, [threshold], **kwargs)
+    return maa, best_transforms[0]
+
+def _grade_scene(task):
+    pred_scene, gt_scene, thresholds, kwargs = task
+    gt_centers = get_camera_centers(gt_scene)
+    # Images missing from the submission count as unregistered
+    pred_centers = get_camera_centers(pred_scene).reindex(gt_centers.index)
+    _, accuracies, _ = evaluate_thresholds(pred_centers, gt_centers, thresholds, **kwargs)
+    return len(gt_centers), accuracies
+
+def grade(submission, ground_truth, thresholds=(0.5,), workers=None, **kwargs):
+    """
+    Registers every (dataset, scene) of the ground truth independently, spread over a pool
+    of `workers` processes (None: one per core, 1: in-process), then averages the scene
+    accuracies per dataset and the dataset accuracies overall. Returns the mAA, the
+    per-threshold accuracies and a per-scene DataFrame.
+    """
+    thresholds = sorted(np.atleast_1d(thresholds).tolist())
+    empty = submission.iloc[:0]
+    pred_scenes = {key: df for key, df in submission.groupby(SCENE_KEYS, sort=False)}
+    keys, tasks = [], []
+    for key, gt_scene in ground_truth.groupby(SCENE_KEYS):
+        keys.append(key)
+        tasks.append((pred_scenes.get(key, empty), gt_scene, thresholds, kwargs))
+    if workers == 1 or len(tasks) <= 1:
+        results = list(map(_grade_scene, tasks))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_grade_scene, tasks))
+
+    scenes = pd.DataFrame(keys, columns=SCENE_KEYS)
+    scenes['images'] = [n for n, _ in results]
+    accuracies = pd.DataFrame([acc for _, acc in results], columns=thresholds)
+    scenes['mAA'] = accuracies.mean(axis=1)
+    per_dataset = accuracies.groupby(scenes['dataset']).mean()
+    per_threshold = per_dataset.mean(axis=0).to_numpy()
+    return float(per_threshold.mean()), per_threshold, scenes
+
+def main(submission_path, ground_truth_path, strategy='auto', max_iters=1000, seed=0,
+         thresholds=(0.5,), workers=None):
     print(f"Loading files:\n- Submission: {submission_path}\n- Ground Truth: {ground_truth_path}")
     submission = load_submission(submission_path)
     ground_truth = load_ground_truth(ground_truth_path)
 
-    pred_centers = get_camera_centers(submission)
-    gt_centers = get_camera_centers(ground_truth)
-
-    maa, _ = evaluate(pred_centers, gt_centers)
+    maa, accuracies, scenes = grade(submission, ground_truth, thresholds, workers=workers,
+                                    strategy=strategy, max_iters=max_iters, seed=seed)
+    if len(scenes) > 1:
+        for row in scenes.itertuples(index=False):
+            print(f"- {row.dataset}/{row.scene} ({row.images} images): mAA {row.mAA:.4f}")
+    if len(accuracies) > 1:
+        for threshold, accuracy in zip(sorted(thresholds), accuracies):
+            print(f"- Accuracy @ {threshold:g}: {accuracy:.4f}")
     print(f"✅ Mean Average Accuracy (mAA): {maa:.4f}")
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python evaluate.py submission.csv test_labels.csv")
-        sys.exit(1)
-    submission_file = sys.argv[1]
-    gt_file = sys.argv[2]
-    main(submission_file, gt_file)
+    parser = argparse.ArgumentParser(description="python evaluate.py submission.csv test_labels.csv")
+    parser.add_argument('submission', help='submission file')
+    parser.add_argument('ground_truth', help='ground truth file')
+    parser.add_argument('--strategy', choices=['auto', 'exhaustive', 'ransac'], default='auto',
+                        help='triplet search strategy')
+    parser.add_argument('--max-iters', type=int, default=1000, help='RANSAC iteration budget')
+    parser.add_argument('--seed', type=int, default=0, help='RANSAC random seed')
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[0.5],
+                        help='camera center distance thresholds averaged into the mAA')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='processes used to grade scenes in parallel (default: one per core)')
+    args = parser.parse_args()
+    main(args.submission, args.ground_truth, args.strategy, args.max_iters, args.seed,
+         args.thresholds, args.workers)
 # python evaluate.py submission.csv test_labels.csv
@@ -1,10 +1,104 @@
-from typing import List
+import itertools
+from typing import List, Tuple
 
 import numpy as np
 import pandas as pd
-from Levenshtein import distance
 
-from mlebench.grade_helpers import InvalidSubmissionError
+
+class InvalidSubmissionError(Exception):
+    """
+    A custom exception for when the agent submission cannot be graded.
+    """
+
+    pass
+
+
+EDIT_OPERATIONS = ["insertions", "deletions", "substitutions"]
+
+
+def encode_sequences(sequences: List[List[int]], vocabulary: pd.Index) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Encode gesture sequences as a (n, max_len) matrix of vocabulary codes padded with -1,
+    plus the (n,) sequence lengths. Codes are int8 whenever the vocabulary allows it.
+    """
+    lengths = np.fromiter(map(len, sequences), dtype=np.int64, count=len(sequences))
+    dtype = np.int8 if len(vocabulary) <= np.iinfo(np.int8).max else np.int32
+    codes = np.full((len(sequences), lengths.max(initial=0)), -1, dtype=dtype)
+    flat = vocabulary.get_indexer(np.fromiter(itertools.chain.from_iterable(sequences), dtype=np.int64))
+    rows = np.repeat(np.arange(len(sequences)), lengths)
+    cols = np.arange(len(flat)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    codes[rows, cols] = flat
+    return codes, lengths
+
+
+def _batch_edit_operations(a, a_len, b, b_len):
+    """
+    Levenshtein DP over a batch of padded sequence pairs, one DP row per position of `a`.
+    Within a row the left-to-right (insertion) dependency is resolved with a prefix minimum,
+    so each row is a handful of array operations over the whole batch.
+    Only the distance and the substitution count of one optimal path are tracked: at cell
+    (i, j) insertions - deletions == j - i, which fixes the other two counts.
+    Returns (n, 3) counts of insertions, deletions and substitutions.
+    """
+    n, width = len(a), b.shape[1] + 1
+    j = np.arange(width, dtype=np.int32)
+    rows = np.arange(n)[:, None]
+    dist = np.broadcast_to(j, (n, width)).copy()
+    subs = np.zeros((n, width), dtype=np.int32)
+    final_dist = np.where(a_len == 0, b_len, 0)
+    final_subs = np.zeros(n, dtype=np.int64)
+
+    for i in range(a.shape[1]):
+        # diagonal (match / substitution) vs. up (deletion of a[i])
+        mismatch = a[:, i, None] != b
+        diag = dist[:, :-1] + mismatch
+        up = dist[:, 1:] + 1
+        take_diag = diag <= up
+        cand = np.empty_like(dist)
+        cand[:, 0] = dist[:, 0] + 1
+        cand[:, 1:] = np.where(take_diag, diag, up)
+        cand_subs = np.empty_like(subs)
+        cand_subs[:, 0] = subs[:, 0]
+        cand_subs[:, 1:] = np.where(take_diag, subs[:, :-1] + mismatch, subs[:, 1:])
+
+        # left (insertion of b[j]): dist[j] = min_k<=j cand[k] + (j - k); ties keep the largest k
+        key = (cand - j).astype(np.int64) * width + (width - 1 - j)
+        best = width - 1 - np.minimum.accumulate(key, axis=1) % width
+        dist = cand[rows, best] + (j - best).astype(np.int32)
+        subs = cand_subs[rows, best]
+
+        done = np.flatnonzero(a_len == i + 1)
+        final_dist[done] = dist[done, b_len[done]]
+        final_subs[done] = subs[done, b_len[done]]
+
+    indels = final_dist - final_subs
+    shift = b_len - a_len
+    return np.stack([(indels + shift) // 2, (indels - shift) // 2, final_subs], axis=1)
+
+
+def edit_operations(y_true: List[List[int]], y_pred: List[List[int]], batch_size: int = 4096) -> pd.DataFrame:
+    """
+    Per-row Levenshtein distance between truth and prediction, split into insertions (extra
+    predicted gestures), deletions (missed true gestures) and substitutions (wrong labels).
+    Rows are sorted by length and processed in batches to keep padding small.
+    """
+    vocabulary = pd.Index(pd.unique(np.fromiter(
+        itertools.chain(itertools.chain.from_iterable(y_true), itertools.chain.from_iterable(y_pred)),
+        dtype=np.int64,
+    )))
+    a, a_len = encode_sequences(y_true, vocabulary)
+    b, b_len = encode_sequences(y_pred, vocabulary)
+
+    counts = np.zeros((len(y_true), 3), dtype=np.int64)
+    order = np.lexsort((b_len, a_len))
+    for start in range(0, len(order), batch_size):
+        idx = order[start:start + batch_size]
+        la, lb = a_len[idx].max(initial=0), b_len[idx].max(initial=0)
+        counts[idx] = _batch_edit_operations(a[idx, :la], a_len[idx], b[idx, :lb], b_len[idx])
+
+    result = pd.DataFrame(counts, columns=EDIT_OPERATIONS)
+    result["distance"] = counts.sum(axis=1)
+    return result
 
 
 def final_edit_distance(y_true: List[int], y_pred: List[int]) -> float:
@@ -15,9 +109,29 @@ def final_edit_distance(y_true: List[int], y_pred: List[int]) -> float:
       However, it can exceed one.
       (https://www.kaggle.com/competitions/multi-modal-gesture-recognition/overview)
     """
-    sum_of_distances = np.sum([distance(a, b) for a, b in zip(y_true, y_pred)])
+    return edit_distance_breakdown(y_true, y_pred)["score"]
+
+
+def edit_distance_breakdown(y_true: List[int], y_pred: List[int]) -> dict:
+    """Normalized edit distance together with the total insertion, deletion and substitution counts."""
+    operations = edit_operations(y_true, y_pred)
     total_num_gestures = sum(len(x) for x in y_true)
-    return sum_of_distances / total_num_gestures
+    breakdown = {"score": operations["distance"].sum() / total_num_gestures}
+    breakdown.update({name: int(operations[name].sum()) for name in EDIT_OPERATIONS})
+    return breakdown
+
+
+def _parse_sequences(sequences: pd.Series) -> List[np.ndarray]:
+    """Split every space-separated sequence at once and convert all tokens in a single cast."""
+    tokens = [x.split() for x in sequences]
+    lengths = np.fromiter(map(len, tokens), dtype=np.int64, count=len(tokens))
+    flat = list(itertools.chain.from_iterable(tokens))
+    try:
+        values = np.array(flat, dtype=str).astype(np.int64)
+    except ValueError:
+        # re-parse with int() so the error names the offending token as before
+        values = np.array(list(map(int, flat)), dtype=np.int64)
+    return np.split(values, np.cumsum(lengths)[:-1])
 
 
 def prepare_for_metric(submission: pd.DataFrame, answers: pd.DataFrame):
@@ -42,9 +156,9 @@ def prepare_for_metric(submission: pd.DataFrame, answers: pd.DataFrame):
     # Read as strings, convert to list of numbers
     submission["Sequence"] = submission["Sequence"].astype(str)
     answers["Sequence"] = answers["Sequence"].astype(str)
-    answers_sequences = [list(map(int, x.split())) for x in answers["Sequence"]]
+    answers_sequences = _parse_sequences(answers["Sequence"])
     try:
-        submission_sequences = [list(map(int, x.split())) for x in submission["Sequence"]]
+        submission_sequences = _parse_sequences(submission["Sequence"])
     except ValueError as e:
         raise InvalidSubmissionError(
             f"Submission sequences must be integers separated by spaces. Failed to convert Sequence to list of integers: {e}"
@@ -3,34 +3,73 @@ import numpy as np
 import sys
 from pathlib import Path
 
-def evaluate_submission(submission_path, test_labels_path):
-    # 1. 读取文件
-    submission = pd.read_csv(submission_path, dtype={"id": str})
-    groundtruth = pd.read_csv(test_labels_path, dtype={"id": str})
+TRAIT_COLUMNS = ["X4", "X11", "X18", "X26", "X50", "X3112"]
+REQUIRED_COLUMNS = ["id"] + TRAIT_COLUMNS
+
+
+def _read(table):
+    if isinstance(table, pd.DataFrame):
+        return table
+    return pd.read_csv(table, dtype={"id": str})
+
+
+def align_predictions(submission, ids, dtype=np.float32):
+    """
+    按 id 哈希连接把 submission 对齐到答案的 id 顺序，返回 (n, 6) 的预测矩阵。
+    submission 的行顺序可以任意，但 id 必须与答案一一对应。
+    """
+    # 检查列名是否一致
+    if list(submission.columns) != REQUIRED_COLUMNS:
+        raise ValueError(f"submission.csv 列名应为: {REQUIRED_COLUMNS}，但检测到: {list(submission.columns)}")
 
-    # 2. 检查列名是否一致
-    required_columns = ["id", "X4", "X11", "X18", "X26", "X50", "X3112"]
-    if list(submission.columns) != required_columns:
-        raise ValueError(f"submission.csv 列名应为: {required_columns}，但检测到: {list(submission.columns)}")
+    # 检查 id 是否一一对应（顺序可以不同）
+    sub_ids = pd.Index(submission["id"])
+    if len(submission) != len(ids) or not sub_ids.is_unique:
+        raise ValueError("submission.csv 的 id 列与 test_labels.csv 不一致")
+    positions = sub_ids.get_indexer(ids)
+    if (positions < 0).any():
+        raise ValueError("submission.csv 的 id 列与 test_labels.csv 不一致")
 
-    # 3. 检查 id 是否一一对应（顺序一致）
-    if not submission["id"].equals(groundtruth["id"]):
-        raise ValueError("submission.csv 的 id 列与 test_labels.csv 不一致或顺序错乱")
+    return submission[TRAIT_COLUMNS].to_numpy(dtype=dtype)[positions]
 
-    # 4. 计算 R²
-    r2_scores = {}
-    for trait in required_columns[1:]:
-        y_true = groundtruth[trait].values
-        y_pred = submission[trait].values
 
-        ss_res = np.sum((y_true - y_pred) ** 2)
-        ss_tot = np.sum((y_true - np.mean(y_true)) ** 2)
+def r2_matrix(y_true, y_pred):
+    """
+    y_true: (n, 6)，y_pred: (n, 6) 或 (m, n, 6) 的多份提交。
+    一次矩阵运算得到每份提交每个性状的 R²（小于 0 或答案方差为 0 的视为 0）；
+    数据可以是 float32，求和按 float64 累加。
+    """
+    y_true = np.asarray(y_true)
+    y_pred = np.asarray(y_pred)
+    ss_res = np.sum(np.square(y_pred - y_true, dtype=np.float64), axis=-2)
+    ss_tot = np.sum(np.square(y_true - np.mean(y_true, axis=0, dtype=np.float64)), axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r2 = np.where(ss_tot > 0, 1 - ss_res / ss_tot, -np.inf)
+    return np.where(r2 > 0, r2, 0.0)
 
-        r2 = 1 - ss_res / ss_tot if ss_tot > 0 else float("-inf")
-        r2_scores[trait] = r2 if r2 > 0 else 0.0
 
-    # 5. 平均 R²
-    mean_r2 = np.mean(list(r2_scores.values()))
+def evaluate_submissions(submissions, test_labels_path, dtype=np.float32):
+    """
+    同时评测多份候选提交（文件路径或 DataFrame），返回 R² 矩阵：
+    每行一份提交，每列一个性状，外加平均 R² 列 mean_r2。
+    """
+    groundtruth = _read(test_labels_path)
+    ids = groundtruth["id"]
+    y_true = groundtruth[TRAIT_COLUMNS].to_numpy(dtype=dtype)
+    y_pred = np.stack([align_predictions(_read(submission), ids, dtype) for submission in submissions])
+
+    scores = pd.DataFrame(r2_matrix(y_true, y_pred), columns=TRAIT_COLUMNS)
+    scores["mean_r2"] = scores[TRAIT_COLUMNS].mean(axis=1)
+    scores.index = [i if isinstance(s, pd.DataFrame) else str(s) for i, s in enumerate(submissions)]
+    return scores
+
+
+def evaluate_submission(submission_path, test_labels_path):
+    scores = evaluate_submissions([submission_path], test_labels_path)
+    r2_scores = scores[TRAIT_COLUMNS].iloc[0].to_dict()
+
+    # 平均 R²
+    mean_r2 = scores["mean_r2"].iloc[0]
 
     print("各性状 R²（小于 0 的视为 0）:")
     for k, v in r2_scores.items():
@@ -41,12 +80,15 @@ def evaluate_submission(submission_path, test_labels_path):
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("用法: python evaluate.py <submission.csv> <test_labels.csv>")
+    if len(sys.argv) < 3:
+        print("用法: python evaluate.py <submission.csv> [<submission2.csv> ...] <test_labels.csv>")
         sys.exit(1)
 
-    submission_path = Path(sys.argv[1])
-    test_labels_path = Path(sys.argv[2])
-    evaluate_submission(submission_path, test_labels_path)
+    test_labels_path = Path(sys.argv[-1])
+    if len(sys.argv) == 3:
+        evaluate_submission(Path(sys.argv[1]), test_labels_path)
+    else:
+        scores = evaluate_submissions([Path(p) for p in sys.argv[1:-1]], test_labels_path)
+        print(scores.to_string(float_format="{:.4f}".format))
 
-# python evaluate.py raw/public/submission.csv raw/private/test_labels.csv
\ No newline at end of file
+# python evaluate.py raw/public/submission.csv raw/private/test_labels.csv
@@ -1,32 +1,165 @@
+import argparse
+
 import pandas as pd
-import ast
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
 
-def evaluate_mrr_by_order(submission_path, groundtruth_path, k=100):
-    # 加载数据
-    submission_df = pd.read_csv(submission_path)
-    groundtruth_df = pd.read_csv(groundtruth_path)
+"""
+python grade.py openhandsgpt/submission.parquet gt_task1.csv --k 1 10 100
+提交文件可以是 parquet（规范格式，预测列为 100 个 ASIN 的列表）或 CSV（预测列为列表的字符串形式）。
+两边都有 session_id 列时按 session_id 对齐，否则按行顺序对齐。
+"""
+
+PREDICTION_COLUMNS = ["predictions", "next_item_prediction"]
+# CSV 中按字符串读取的列，避免纯数字的 ASIN 被转成整数
+STRING_COLUMNS = ["next_item"] + PREDICTION_COLUMNS
+
+
+def _as_array(column, type=None):
+    """pandas/list/Arrow 的列统一转成单块 Arrow 数组。"""
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks()
+    elif not isinstance(column, pa.Array):
+        column = pa.array(column, type=type)
+    return column if type is None else column.cast(type)
+
+
+def parse_list_strings(predictions):
+    """把形如 ['B07...', 'B08...'] 的列表字符串批量切分成 Arrow 的列表数组。"""
+    predictions = pc.utf8_trim_whitespace(_as_array(predictions, pa.string()))
+    bracketed = pc.and_(pc.starts_with(predictions, "["), pc.ends_with(predictions, "]"))
+    bad = np.flatnonzero(~pc.fill_null(bracketed, False).to_numpy(zero_copy_only=False))
+    assert len(bad) == 0, f"第 {bad[0]} 行的预测不是 [...] 形式的列表"
+
+    lists = pc.split_pattern(pc.utf8_slice_codeunits(predictions, 1, -1), ",")
+    items = pc.utf8_trim_whitespace(pc.list_flatten(lists))
+    # 每个元素都必须带引号；只有空列表 "[]" 允许切出唯一一个空串
+    quoted = pc.and_(pc.greater_equal(pc.utf8_length(items), 2), pc.or_(
+        pc.and_(pc.starts_with(items, "'"), pc.ends_with(items, "'")),
+        pc.and_(pc.starts_with(items, '"'), pc.ends_with(items, '"'))))
+    lengths = pc.list_value_length(lists).to_numpy(zero_copy_only=False)
+    parents = pc.list_parent_indices(lists).to_numpy(zero_copy_only=False)
+    empty_list = pc.equal(items, "").to_numpy(zero_copy_only=False) & (lengths[parents] == 1)
+    bad = parents[~(quoted.to_numpy(zero_copy_only=False) | empty_list)]
+    assert len(bad) == 0, f"第 {bad[0]} 行的预测中有未加引号的商品"
+    return pa.ListArray.from_arrays(lists.offsets, pc.utf8_trim(items, "'\""))
+
+
+def parse_prediction_lists(predictions, k=100):
+    """
+    把预测列（Arrow 列表数组，或列表的字符串形式）编码为 (n, k) 的商品编码矩阵与词表
+    （pyarrow 字符串数组）。去引号与字典编码（字符串驻留）都在 Arrow 内一次完成；
+    不足 k 个的位置填 -1。
+    """
+    predictions = _as_array(predictions)
+    if not (pa.types.is_list(predictions.type) or pa.types.is_large_list(predictions.type)):
+        predictions = parse_list_strings(predictions)
+    lists = predictions.cast(pa.list_(pa.string()))
+    lengths = pc.list_value_length(lists).fill_null(0).to_numpy(zero_copy_only=False)
+    encoded = pc.dictionary_encode(pc.list_flatten(lists))
+    flat_codes = encoded.indices.to_numpy(zero_copy_only=False).astype(np.int64)
+    vocabulary = encoded.dictionary
+
+    # 空列表 "[]" 切分后是一个空串，不算作预测
+    empty = pc.index_in(pa.array([""]), value_set=vocabulary)[0].as_py()
+    if empty is not None:
+        flat_codes[flat_codes == empty] = -1
+
+    # 每行只保留前 k 个
+    position = np.arange(len(flat_codes)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    keep = position < k
+    codes = np.full((len(lengths), k), -1, dtype=np.int64)
+    codes[np.repeat(np.arange(len(lengths)), lengths)[keep], position[keep]] = flat_codes[keep]
+    return codes, vocabulary
 
-    # 基础校验
-    assert len(submission_df) == len(groundtruth_df), "行数不一致：submission 和 groundtruth 数量不同"
 
-    total_rr = 0.0
-    num_samples = len(submission_df)
+def encode_items(items, vocabulary):
+    """按词表编码真实商品，不在词表中（任何预测里都没出现）的编码为 -1。"""
+    items = _as_array(items, pa.string())
+    codes = pc.index_in(items, value_set=vocabulary)
+    return pc.fill_null(codes, -1).to_numpy(zero_copy_only=False).astype(np.int64)
 
-    for i in range(num_samples):
-        preds = ast.literal_eval(submission_df.iloc[i]["predictions"])[:k]
-        true_item = groundtruth_df.iloc[i]["next_item"]
 
-        try:
-            rank = preds.index(true_item) + 1  # 排名从1开始
-            rr = 1.0 / rank
-        except ValueError:
-            rr = 0.0  # 没有命中
+def hit_ranks(codes, true_codes):
+    """真实商品在每行预测中的排名（从1开始），未命中为0。"""
+    hits = (codes == true_codes[:, None]) & (true_codes[:, None] >= 0)
+    return np.where(hits.any(axis=1), hits.argmax(axis=1) + 1, 0)
 
-        total_rr += rr
 
-    mrr = total_rr / num_samples
-    print(f"MRR@{k}: {mrr:.6f}")
-    return mrr
+def ranking_metrics(ranks, ks=(100,)):
+    """
+    由同一个排名向量计算各个 k 下的 MRR@k、Hit@k 与 NDCG@k（每个会话只有一个相关商品，
+    所以 NDCG@k = 1/log2(rank+1)）。均值按行顺序累加。
+    """
+    num_samples = len(ranks)
+    metrics = {}
+    for k in ks:
+        hit = (ranks > 0) & (ranks <= k)
+        safe = np.where(hit, ranks, 1)
+        rr = np.where(hit, 1.0 / safe, 0.0)
+        gain = np.where(hit, 1.0 / np.log2(safe + 1.0), 0.0)
+        metrics[k] = {
+            "MRR": sum(rr.tolist()) / num_samples,
+            "Hit": int(hit.sum()) / num_samples,
+            "NDCG": sum(gain.tolist()) / num_samples,
+        }
+    return metrics
+
+
+def read_table(path):
+    """读取 parquet 或 CSV 为 Arrow 表；parquet 的列表列直接以 Arrow 列表读入，不做字符串解析。"""
+    if str(path).endswith(".parquet"):
+        return pq.read_table(path)
+    column_types = {name: pa.string() for name in STRING_COLUMNS}
+    return pv.read_csv(path, convert_options=pv.ConvertOptions(column_types=column_types))
+
+
+def align_sessions(submission, groundtruth, id_col="session_id"):
+    """
+    返回 groundtruth 每一行在 submission 中对应的行号。两边都有 id_col 时按 id 对齐，
+    否则要求行数一致并按行顺序对齐。
+    """
+    if id_col in submission.column_names and id_col in groundtruth.column_names:
+        sub_ids = pd.Index(submission[id_col].to_pandas())
+        assert sub_ids.is_unique, f"submission 中 {id_col} 有重复"
+        positions = sub_ids.get_indexer(groundtruth[id_col].to_pandas())
+        missing = int((positions < 0).sum())
+        assert missing == 0, f"submission 缺少 {missing} 个会话"
+        return positions
+    assert submission.num_rows == groundtruth.num_rows, "行数不一致：submission 和 groundtruth 数量不同"
+    return np.arange(groundtruth.num_rows)
+
+
+def evaluate(submission_path, groundtruth_path, ks=(100,), id_col="session_id"):
+    """对 parquet/CSV 提交计算各个 k 下的 MRR@k、Hit@k、NDCG@k；排名只计算一次。"""
+    ks = sorted(set(ks))
+    submission = read_table(submission_path)
+    groundtruth = read_table(groundtruth_path)
+    pred_col = next((name for name in PREDICTION_COLUMNS if name in submission.column_names), None)
+    assert pred_col is not None, f"submission 缺少预测列，需要 {PREDICTION_COLUMNS} 之一"
+
+    codes, vocabulary = parse_prediction_lists(submission[pred_col], max(ks))
+    codes = codes[align_sessions(submission, groundtruth, id_col)]
+    ranks = hit_ranks(codes, encode_items(groundtruth["next_item"], vocabulary))
+    metrics = ranking_metrics(ranks, ks)
+    for k in ks:
+        print(f"MRR@{k}: {metrics[k]['MRR']:.6f}  Hit@{k}: {metrics[k]['Hit']:.6f}  NDCG@{k}: {metrics[k]['NDCG']:.6f}")
+    return metrics
+
+
+def evaluate_mrr_by_order(submission_path, groundtruth_path, k=100):
+    return evaluate(submission_path, groundtruth_path, ks=(k,), id_col=None)[k]["MRR"]
+
 
-# 示例用法：
-evaluate_mrr_by_order("openhandsgpt/submission.csv", "gt_task1.csv", k=100)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("submission", nargs="?", default="openhandsgpt/submission.csv",
+                        help="提交文件（.parquet 或 .csv）")
+    parser.add_argument("groundtruth", nargs="?", default="gt_task1.csv", help="答案文件（.csv 或 .parquet）")
+    parser.add_argument("--k", type=int, nargs="+", default=[100], help="计算 MRR/Hit/NDCG 的 k 值")
+    parser.add_argument("--id-col", default="session_id", help="对齐会话的 id 列，不存在时按行顺序对齐")
+    args = parser.parse_args()
+    evaluate(args.submission, args.groundtruth, args.k, args.id_col)
@@ -1,6 +1,5 @@
 import numpy as np
 import pandas as pd
-from sklearn.metrics import root_mean_squared_error
 
 class InvalidSubmissionError(Exception):
     """
@@ -9,14 +8,33 @@ class InvalidSubmissionError(Exception):
 
     pass
 
-def grade(submission: pd.DataFrame, answers: pd.DataFrame) -> float:
+TO_PREDICT = ["reactivity", "deg_Mg_pH10", "deg_Mg_50C"]
+
+
+def split_id_seqpos(id_seqpos: pd.Series) -> tuple:
+    """
+    Split `id_seqpos` values such as `id_001f94081_0` in one vectorized pass into the sequence
+    id strings, the integer positions, and a mask of malformed values (position -1). Positions
+    too long to fit in int64 count as malformed.
+    """
+    parts = id_seqpos.astype(str).str.rpartition("_")
+    valid = (parts[1] == "_") & parts[2].str.fullmatch(r"\d{1,18}")
+    position = parts[2].where(valid, "-1").astype(np.int64).to_numpy()
+    return parts[0], position, ~valid.to_numpy()
+
+
+def grade_with_profile(submission: pd.DataFrame, answers: pd.DataFrame) -> tuple:
+    """
+    MCRMSE over the kept rows, plus a per-sequence-position RMSE profile (one row per position,
+    one column per target, with the position's MCRMSE and the number of scored rows).
+    """
     if len(submission) != len(answers):
         raise InvalidSubmissionError(
             f"Expected submission to be the same length as answers, but got {len(submission)} "
             f"instead of {len(answers)}."
         )
 
-    to_predict = ["reactivity", "deg_Mg_pH10", "deg_Mg_50C"]
+    to_predict = TO_PREDICT
     expected_answer_columns = ["id_seqpos"] + to_predict + ["keep"]
 
     assert set(answers.columns).issuperset(expected_answer_columns), (
@@ -37,36 +55,61 @@ def grade(submission: pd.DataFrame, answers: pd.DataFrame) -> float:
             f"it has columns {submission.columns}."
         )
 
-    filtered_submission = submission[expected_submission_columns]
-
-    # Sort rows by `id_seqpos` and columns alphabetically
-    sorted_submission = filtered_submission.sort_values(by="id_seqpos").sort_index(axis=1)
-    sorted_answers = answers.sort_values(by="id_seqpos").sort_index(axis=1)
-
-    for i, (actual_id, expected_id) in enumerate(
-        zip(sorted_submission["id_seqpos"], sorted_answers["id_seqpos"])
-    ):
-        if actual_id == expected_id:
-            continue
-
+    # Parse `id_seqpos` into (sequence, position) integers; sequence ids are coded against the
+    # answers so both sides share one vocabulary
+    answer_ids, answer_position, answer_bad = split_id_seqpos(answers["id_seqpos"])
+    assert not answer_bad.any(), "Expected every answer `id_seqpos` to end with `_<position>`."
+    answer_sequence, vocabulary = pd.factorize(answer_ids)
+    sub_ids, sub_position, sub_bad = split_id_seqpos(submission["id_seqpos"])
+    sub_sequence = pd.Index(vocabulary).get_indexer(sub_ids)
+
+    # Align on one integer key per row; the key width comes from the answers alone, so unknown,
+    # malformed or out-of-range submission ids get key -1 and never match
+    width = answer_position.max(initial=0) + 1
+    sub_bad = sub_bad | (sub_position >= width)
+    answer_key = answer_sequence * width + answer_position
+    sub_key = np.where(sub_bad | (sub_sequence < 0), -1, sub_sequence * width + sub_position)
+    answer_order = np.argsort(answer_key, kind="stable")
+    sub_order = np.argsort(sub_key, kind="stable")
+
+    mismatch = np.flatnonzero(sub_key[sub_order] != answer_key[answer_order])
+    if len(mismatch):
+        i = mismatch[0]
+        actual_id = submission["id_seqpos"].iloc[sub_order[i]]
+        expected_id = answers["id_seqpos"].iloc[answer_order[i]]
         raise InvalidSubmissionError(
             f"Expected submission to have the same `id_seqpos` as answers, but got `{actual_id}` "
             f"instead of `{expected_id}` on row {i} of the submission."
         )
 
-    mask = sorted_answers["keep"]
-    new_submission = sorted_submission[mask]
-    new_answers = sorted_answers[mask]
+    # One masked (n, 3) operation for all targets
+    keep = answers["keep"].to_numpy(dtype=bool)[answer_order]
+    y_true = answers[to_predict].to_numpy(dtype=np.float64)[answer_order][keep]
+    y_pred = submission[to_predict].to_numpy(dtype=np.float64)[sub_order][keep]
+    if not np.isfinite(y_pred).all():
+        raise InvalidSubmissionError("Expected the scored submission rows to contain only finite numbers.")
+    squared_errors = np.square(y_true - y_pred)
+    errors = np.sqrt(squared_errors.mean(axis=0))
+
+    # Per-position profile from the same squared errors
+    position = answer_position[answer_order][keep]
+    counts = np.bincount(position, minlength=width)
+    sums = np.stack(
+        [np.bincount(position, weights=squared_errors[:, j], minlength=width) for j in range(len(to_predict))],
+        axis=1,
+    )
+    scored = np.flatnonzero(counts)
+    profile = pd.DataFrame(np.sqrt(sums[scored] / counts[scored, None]), columns=to_predict)
+    profile.index = pd.Index(scored, name="seqpos")
+    profile["mcrmse"] = profile[to_predict].mean(axis=1)
+    profile["count"] = counts[scored]
 
-    errors = []
+    return np.mean(errors), profile
 
-    for column in to_predict:
-        y_pred = new_submission[column]
-        y_true = new_answers[column]
-        error = root_mean_squared_error(y_true=y_true, y_pred=y_pred)
-        errors.append(error)
 
-    return np.mean(errors)
+def grade(submission: pd.DataFrame, answers: pd.DataFrame) -> float:
+    score, _ = grade_with_profile(submission, answers)
+    return score
 
 
 # 1. 读取提交文件和答案文件
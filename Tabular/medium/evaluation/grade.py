@@ -1,17 +1,83 @@
+import heapq
+
+import numpy as np
 import pandas as pd
 import sys
-from sklearn.metrics import matthews_corrcoef
 
-def evaluate_submission(test_label_path='test_label.csv', submission_path='submission.csv'):
+# class 列固定的类别字典，读入后直接是 0/1 编码
+CLASSES = ["e", "p"]
+
+
+def read_labels(path):
+    """读取 id + class 两列，class 按固定字典 {e, p} 读成 categorical，字典外的值为缺失。"""
+    columns = list(pd.read_csv(path, nrows=0).columns)
+    if len(columns) < 2:
+        return pd.read_csv(path)
+    df = pd.read_csv(path, dtype={columns[1]: "category"})
+    df[columns[1]] = df[columns[1]].cat.set_categories(CLASSES)
+    return df
+
+
+def confusion_mcc(y_true, y_pred):
+    """
+    由 0/1 编码的 bincount 2x2 混淆矩阵计算 MCC，公式与 sklearn 的 matthews_corrcoef 相同。
+    """
+    C = np.bincount(y_true.astype(np.int64) * 2 + y_pred, minlength=4).reshape(2, 2)
+    t_sum = C.sum(axis=1, dtype=np.float64)
+    p_sum = C.sum(axis=0, dtype=np.float64)
+    n_correct = np.trace(C, dtype=np.float64)
+    n_samples = p_sum.sum()
+    cov_ytyp = n_correct * n_samples - np.dot(t_sum, p_sum)
+    cov_ypyp = n_samples**2 - np.dot(p_sum, p_sum)
+    cov_ytyt = n_samples**2 - np.dot(t_sum, t_sum)
+    if cov_ypyp * cov_ytyt == 0:
+        return 0.0
+    return float(cov_ytyp / np.sqrt(cov_ytyt * cov_ypyp))
+
+def smallest(values, k):
+    """values 中最小的 k 个（升序，空值排在最后），只做部分选择而不排序整个数组。"""
+    missing = pd.isna(values)
+    present = values[~missing]
+    if len(present) > k:
+        if present.dtype.kind in "iufb":
+            present = np.partition(present, k - 1)[:k]
+        else:
+            present = np.array(heapq.nsmallest(k, present), dtype=present.dtype)
+    examples = np.sort(present).tolist()
+    return examples + values[missing][:k - len(examples)].tolist()
+
+
+def id_mismatches(test_ids, sub_ids, max_examples=10):
+    """
+    基于哈希的 id 差异诊断，O(n)：两边的 id 一起 factorize 一次，按编码统计缺失、多余、
+    重复三类 id 的精确个数与最小的 max_examples 个示例，形如 {"缺失": (count, examples), ...}。
+    """
+    if test_ids.dtype != sub_ids.dtype:
+        # 类型不同（如空 id 让整列变成浮点）时按原始 Python 值比较，示例里保持原样
+        test_ids, sub_ids = test_ids.astype(object), sub_ids.astype(object)
+    # 空 id 也要分配编码，作为多余/缺失的 id 报告
+    codes, uniques = pd.factorize(np.concatenate([test_ids, sub_ids]), use_na_sentinel=False)
+    uniques = np.asarray(uniques)
+    test_count = np.bincount(codes[:len(test_ids)], minlength=len(uniques))
+    sub_count = np.bincount(codes[len(test_ids):], minlength=len(uniques))
+    groups = {
+        "缺失": uniques[(test_count > 0) & (sub_count == 0)],
+        "多余": uniques[(sub_count > 0) & (test_count == 0)],
+        "重复": uniques[sub_count > 1],
+    }
+    return {name: (len(ids), smallest(ids, max_examples)) for name, ids in groups.items()}
+
+
+def evaluate_submission(test_label_path='test_label.csv', submission_path='submission.csv', max_examples=10):
     # 读取文件
     try:
-        test_df = pd.read_csv(test_label_path)
+        test_df = read_labels(test_label_path)
     except Exception as e:
         print("Error reading test_label.csv:", e)
         return
 
     try:
-        sub_df = pd.read_csv(submission_path)
+        sub_df = read_labels(submission_path)
     except Exception as e:
         print("Error reading submission.csv:", e)
         return
@@ -26,46 +92,45 @@ def evaluate_submission(test_label_path='test_label.csv', submission_path='submi
     # 假设第一列是 'id'，第二列是 'class'
     id_col, class_col = test_df.columns[0], test_df.columns[1]
 
-    # 检查 id 是否一一对应（顺序可能不同，但必须完全匹配）
-    test_ids = set(test_df[id_col])
-    sub_ids = set(sub_df[id_col])
-
-    if test_ids != sub_ids:
-        print("格式错误：submission.csv 中的 id 与 test_label.csv 不匹配")
-        missing_in_sub = test_ids - sub_ids
-        extra_in_sub = sub_ids - test_ids
-        if missing_in_sub:
-            print(f"以下 id 缺失: {sorted(missing_in_sub)[:10]} {'...' if len(missing_in_sub) > 10 else ''}")
-        if extra_in_sub:
-            print(f"以下 id 多余: {sorted(extra_in_sub)[:10]} {'...' if len(extra_in_sub) > 10 else ''}")
-        return
-
-    # 确保 submission 中的顺序与 test_label 一致（按 id 排序）
-    test_df = test_df.sort_values(by=id_col).reset_index(drop=True)
-    sub_df = sub_df.sort_values(by=id_col).reset_index(drop=True)
+    # 检查 id 是否一一对应（顺序可能不同，但必须完全匹配）：两边各排序一次后逐个比较
+    # （id 类型不同或有空 id 则不可能对齐，直接进入诊断，不必排序）
+    test_ids = test_df[id_col].to_numpy()
+    sub_ids = sub_df[id_col].to_numpy()
+    aligned = (len(test_ids) == len(sub_ids) and test_ids.dtype == sub_ids.dtype
+               and not pd.isna(sub_ids).any() and not pd.isna(test_ids).any())
+    if aligned:
+        test_order = np.argsort(test_ids, kind="stable")
+        sub_order = np.argsort(sub_ids, kind="stable")
+        aligned = np.array_equal(test_ids[test_order], sub_ids[sub_order])
 
-    # 再次确认 id 完全对齐
-    if not (test_df[id_col].equals(sub_df[id_col])):
-        print("格式错误：id 无法一一对应（排序后仍不一致）")
+    if not aligned:
+        mismatches = id_mismatches(test_ids, sub_ids, max_examples)
+        if mismatches["缺失"][0] or mismatches["多余"][0]:
+            print("格式错误：submission.csv 中的 id 与 test_label.csv 不匹配")
+        else:
+            print("格式错误：id 无法一一对应（排序后仍不一致）")
+        for name, (count, examples) in mismatches.items():
+            if count:
+                print(f"以下 id {name}（共 {count} 个）: {examples} {'...' if count > max_examples else ''}")
         return
 
-    # 获取真实标签和预测标签
-    y_true = test_df[class_col]
-    y_pred = sub_df[class_col]
+    # 按 id 排序后的 0/1 编码（-1 表示不在 {e, p} 中）
+    y_true = test_df[class_col].cat.codes.to_numpy()[test_order]
+    y_pred = sub_df[class_col].cat.codes.to_numpy()[sub_order]
 
-    # 检查类别是否有效（假设类别是像 'e', 'p' 这样的字符串）
-    # 可选：检查是否为字符串类型
-    if not y_pred.apply(lambda x: isinstance(x, str)).all():
-        print("格式错误：class 列包含非字符串值")
+    # 检查类别是否有效：必须是 e 或 p
+    invalid = int(np.count_nonzero(y_pred < 0))
+    if invalid:
+        print(f"格式错误：class 列包含 {CLASSES} 以外的值或空值（{invalid} 行）")
+        return
+    if (y_true < 0).any():
+        print(f"计算 MCC 时出错: test_label.csv 的 class 列包含 {CLASSES} 以外的值")
         return
 
     # 计算 MCC
-    try:
-        mcc = matthews_corrcoef(y_true, y_pred)
-        print(f"得分: {mcc:.6f}")
-    except Exception as e:
-        print("计算 MCC 时出错:", e)
-        return
+    mcc = confusion_mcc(y_true, y_pred)
+    print(f"得分: {mcc:.6f}")
+    return mcc
 
 # 使用方式
 if __name__ == "__main__":
@@ -1,5 +1,7 @@
+import numpy as np
 import pandas as pd
-from sklearn.metrics import accuracy_score
+import pyarrow as pa
+import pyarrow.compute as pc
 
 class InvalidSubmissionError(Exception):
     """
@@ -15,7 +17,55 @@ def grade(submission: pd.DataFrame, answers: pd.DataFrame) -> float:
         target_column="after",
         id_column="id",
     )
-    return accuracy_score(y_pred=accuracy_inputs["y_pred"], y_true=accuracy_inputs["y_true"])
+    return float(accuracy_inputs["correct"].mean())
+
+
+def grade_by_class(submission: pd.DataFrame, answers: pd.DataFrame, class_column: str = "class") -> tuple:
+    """
+    Overall accuracy plus a per-`class` breakdown (accuracy and token count per class), using the
+    class labels of the answers rows that the submission was aligned against.
+    """
+    accuracy_inputs = prepare_for_metric(
+        submission=submission,
+        answers=answers,
+        target_column="after",
+        id_column="id",
+        class_column=class_column,
+    )
+    correct = accuracy_inputs["correct"]
+    codes, classes = pd.factorize(accuracy_inputs["classes"], use_na_sentinel=False)
+    counts = np.bincount(codes, minlength=len(classes))
+    hits = np.bincount(codes, weights=correct, minlength=len(classes))
+    by_class = pd.DataFrame({"accuracy": hits / counts, "count": counts}, index=pd.Index(classes, name=class_column))
+    return float(correct.mean()), by_class.sort_index()
+
+
+def read_frame(path) -> pd.DataFrame:
+    """Read a submission/answers csv with Arrow string columns; `after` is kept verbatim (no NaN parsing)."""
+    return pd.read_csv(path, dtype="string[pyarrow]", keep_default_na=False, na_values=[])
+
+
+def _as_strings(column: pd.Series) -> pa.Array:
+    """
+    Arrow string array of a column of any dtype (including object columns that mix str and int,
+    as `pd.read_csv` produces on large files); missing values read as "nan", as `astype(str)` did.
+    """
+    values = pa.array(column.astype("string[pyarrow]"))
+    if isinstance(values, pa.ChunkedArray):
+        values = values.combine_chunks()
+    return pc.fill_null(values, "nan")
+
+
+def id_keys(ids: pd.Series) -> np.ndarray:
+    """
+    Parse `<sentence_id>_<token_id>` ids into int64 keys (sentence_id << 32 | token_id) in one
+    vectorized pass; malformed ids get key -1.
+    """
+    parts = pc.extract_regex(_as_strings(ids), r"^(?P<sentence>\d+)_(?P<token>\d+)$")
+    ok = pc.is_valid(parts).to_numpy(zero_copy_only=False)
+    sentence = pc.struct_field(parts, "sentence").cast(pa.int64()).fill_null(0).to_numpy()
+    token = pc.struct_field(parts, "token").cast(pa.int64()).fill_null(0).to_numpy()
+    return np.where(ok, (sentence << 32) | token, -1)
 
 
 def prepare_for_metric(
@@ -23,11 +73,14 @@ def prepare_for_metric(
     answers: pd.DataFrame,
     target_column: str,
     id_column: str,
+    class_column: str = None,
 ) -> dict:
 
     # Answers checks
     assert target_column in answers.columns, f"Answers must have a `{target_column}` column"
     assert id_column in answers.columns, f"Answers must have a `{id_column}` column"
+    if class_column is not None:
+        assert class_column in answers.columns, f"Answers must have a `{class_column}` column"
 
     # Submission checks
     if len(submission) != len(answers):
@@ -37,29 +90,43 @@ def prepare_for_metric(
     if id_column not in submission.columns:
         raise InvalidSubmissionError(f"Submission must have a `{id_column}` column")
 
-    # sort on id to ensure correct order
-    submission = submission.sort_values(id_column)
-    answers = answers.sort_values(id_column)
-
-    if (submission[id_column].values != answers[id_column].values).any():
+    # align on (sentence_id, token_id) integer keys
+    submission_keys = id_keys(submission[id_column])
+    answers_keys = id_keys(answers[id_column])
+    assert (answers_keys >= 0).all(), f"Answers `{id_column}` must be `<sentence_id>_<token_id>`"
+    malformed = np.flatnonzero(submission_keys < 0)
+    if len(malformed):
+        raise InvalidSubmissionError(
+            f"Submission `{id_column}` must be `<sentence_id>_<token_id>`, "
+            f"got {submission[id_column].iloc[malformed[0]]!r} on row {malformed[0]}"
+        )
+    submission_order = np.argsort(submission_keys, kind="stable")
+    answers_order = np.argsort(answers_keys, kind="stable")
+
+    if (submission_keys[submission_order] != answers_keys[answers_order]).any():
         raise InvalidSubmissionError(f"Submission and Answers `{id_column}`'s do not match")
 
-    submission[target_column] = submission[target_column].astype(str)
-    answers[target_column] = answers[target_column].astype(str)
+    # exact string match on the Arrow buffers
+    y_pred = _as_strings(submission[target_column]).take(pa.array(submission_order))
+    y_true = _as_strings(answers[target_column]).take(pa.array(answers_order))
+    correct = pc.equal(y_pred, y_true).to_numpy(zero_copy_only=False)
 
-    y_pred = submission[target_column].to_numpy()
-    y_true = answers[target_column].to_numpy()
+    prepared = {"y_true": y_true, "y_pred": y_pred, "correct": correct}
+    if class_column is not None:
+        prepared["classes"] = answers[class_column].to_numpy()[answers_order]
+    return prepared
 
-    return {"y_true": y_true, "y_pred": y_pred}
-
-import pandas as pd
 from pathlib import Path
 
 # 加载 submission 和答案
-submission = pd.read_csv(Path("openhandsds/submission.csv"))
-answers = pd.read_csv(Path("answers.csv"))
+submission = read_frame(Path("openhandsds/submission.csv"))
+answers = read_frame(Path("answers.csv"))
 
 # 调用评分函数
-score = grade(submission=submission, answers=answers)
+if "class" in answers.columns:
+    score, by_class = grade_by_class(submission=submission, answers=answers)
+    print(by_class.to_string(float_format="{:.4f}".format))
+else:
+    score = grade(submission=submission, answers=answers)
 
 print(f"✅ Accuracy: {score:.4f}")